@@ -0,0 +1,51 @@
+from deltapv import linalg
+from jax import numpy as jnp, jit
+from functools import partial
+import argparse
+from ilu import jacobian, timeit
+
+
+@partial(jit, static_argnums=(2, ))
+def solve(spJ, F, method):
+    # Direct linear solve of a Newton step, factorization included
+    return linalg.linsol(spJ, -F, method=method)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the direct solvers of a Newton step: sequential "
+        "block LU (block) against block cyclic reduction (cr)")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        default=[10000, 30000, 100000],
+                        help="Numbers of grid points")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'N':>7} {'kernel':>8} {'compile (s)':>12} {'block (ms)':>11}"
+          f" {'cr (ms)':>8} {'speedup':>8}")
+    for n in args.sizes:
+        spJ, F = jacobian(n)
+        fact = {
+            method: linalg.factor(spJ, method)
+            for method in ("block", "cr")
+        }
+        kernels = {
+            "factor": lambda method: (jit(
+                partial(linalg.factor, method=method)), (spJ, )),
+            "subst": lambda method: (jit(
+                partial(linalg.precond, method=method)), (fact[method], F)),
+            "solve": lambda method: (partial(solve, method=method), (spJ, F))
+        }
+        for name, kernel in kernels.items():
+            (c_block, t_block), (c_cr, t_cr) = [
+                timeit(fun, *fargs, repeat=args.repeat)
+                for fun, fargs in map(kernel, ("block", "cr"))
+            ]
+            print(f"{n:>7} {name:>8} {c_block:>5.2f}/{c_cr:<6.2f}"
+                  f" {1e3 * t_block:>11.2f} {1e3 * t_cr:>8.2f}"
+                  f" {t_block / t_cr:>7.1f}x")
+        x = solve(spJ, F, "cr")
+        err = jnp.linalg.norm(linalg.spmatvec(spJ, x) + F)
+        print(f"{n:>7} {'residual':>8} {err / jnp.linalg.norm(F):.1e}")
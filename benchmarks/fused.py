@@ -0,0 +1,67 @@
+import deltapv as dpv
+from deltapv import residual
+from jax import jit
+import numpy as np
+import argparse
+import re
+from ilu import material, timeit
+
+
+def state(n_points):
+    # Cell, boundary and initial guess out of equilibrium of a p-n junction
+    des = dpv.make_design(n_points=n_points,
+                          Ls=[1e-4, 1e-4],
+                          mats=material,
+                          Ns=[1e17, -1e17],
+                          Snl=1e7,
+                          Snr=0,
+                          Spl=0,
+                          Spr=1e7)
+    cell = dpv.simulator.init_cell(des, dpv.incident_light())
+    bound_eq = dpv.bcond.boundary_eq(cell)
+    pot = dpv.solver.ooe_guess(cell, dpv.solver.eq_guess(cell, bound_eq))
+    bound = dpv.bcond.boundary(cell, 0.)
+    return cell, bound, pot
+
+
+@jit
+def pair(cell, bound, pot):
+    # Residual and Jacobian as evaluated by a Newton step before fusion
+    return (residual.comp_F(cell, bound, pot),
+            residual.comp_F_deriv(cell, bound, pot))
+
+
+def exps(fun, *args):
+    # Number of elementwise exponentials in the optimized program
+    hlo = fun.lower(*args).compile().as_text()
+    shapes = re.findall(r"= f64\[([\d,]*)\]\S* exponential\(", hlo)
+    return sum(
+        int(np.prod([int(d) for d in shape.split(",") if d]))
+        for shape in shapes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Count the exponentials and time the evaluation of the "
+        "residual and Jacobian, with comp_F and comp_F_deriv (pair) against "
+        "comp_F_and_J (fused)")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        default=[500, 5000, 50000],
+                        help="Numbers of grid points")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'N':>7} {'exp/node':>10} {'pair (ms)':>10} {'fused (ms)':>11}"
+          f" {'speedup':>8}")
+    for n in args.sizes:
+        fargs = state(n)
+        e_pair, e_fused = [
+            exps(fun, *fargs) / n for fun in (pair, residual.comp_F_and_J)
+        ]
+        _, t_pair = timeit(pair, *fargs, repeat=args.repeat)
+        _, t_fused = timeit(residual.comp_F_and_J, *fargs, repeat=args.repeat)
+        print(f"{n:>7} {e_pair:>4.1f}/{e_fused:<5.1f}"
+              f" {1e3 * t_pair:>10.2f} {1e3 * t_fused:>11.2f}"
+              f" {t_pair / t_fused:>7.1f}x")
@@ -0,0 +1,98 @@
+import deltapv as dpv
+from deltapv import linalg
+from jax import numpy as jnp, jit, block_until_ready
+from jax.scipy.sparse.linalg import gmres
+from functools import partial
+import argparse
+import time
+
+material = dpv.create_material(Chi=3.9,
+                               Eg=1.5,
+                               eps=9.4,
+                               Nc=8e17,
+                               Nv=1.8e19,
+                               mn=100,
+                               mp=100,
+                               Et=0,
+                               tn=1e-8,
+                               tp=1e-8,
+                               A=2e4)
+
+
+def jacobian(n_points):
+    # Out-of-equilibrium Jacobian at the initial guess of a p-n junction
+    des = dpv.make_design(n_points=n_points,
+                          Ls=[1e-4, 1e-4],
+                          mats=material,
+                          Ns=[1e17, -1e17],
+                          Snl=1e7,
+                          Snr=0,
+                          Spl=0,
+                          Spr=1e7)
+    cell = dpv.simulator.init_cell(des, dpv.incident_light())
+    bound_eq = dpv.bcond.boundary_eq(cell)
+    pot = dpv.solver.ooe_guess(cell, dpv.solver.eq_guess(cell, bound_eq))
+    bound = dpv.bcond.boundary(cell, 0.)
+    spJ = dpv.residual.comp_F_deriv(cell, bound, pot)
+    F = dpv.residual.comp_F(cell, bound, pot)
+    return spJ, F
+
+
+@jit
+def ilu_step(spJ, F):
+    # Linear solve of a Newton step with the scalar ILU of linalg.spilu
+    fact = linalg.spilu(spJ)
+    sol, _ = gmres(partial(linalg.spmatvec, spJ),
+                   -F,
+                   M=lambda b: linalg.bsub(fact, linalg.fsub(fact, b)),
+                   tol=1e-6,
+                   atol=0.,
+                   maxiter=10,
+                   solve_method="batched")
+    return sol
+
+
+@jit
+def block_step(spJ, F):
+    # Linear solve of a Newton step as done by the solver
+    fact = linalg.factor(spJ, "gmres")
+    return linalg.factsol(spJ, fact, -F, 1e-6, "gmres")
+
+
+def timeit(fun, *args, repeat=5):
+    tic = time.perf_counter()
+    block_until_ready(fun(*args))
+    compile_time = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        block_until_ready(fun(*args))
+    return compile_time, (time.perf_counter() - tic) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the factorization and linear solve of a Newton "
+        "step with the scalar ILU (spilu) and the block ILU (factor)")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        default=[500, 5000, 50000],
+                        help="Numbers of grid points")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'N':>7} {'kernel':>12} {'compile (s)':>12} {'spilu (ms)':>11}"
+          f" {'block (ms)':>11} {'speedup':>8}")
+    for n in args.sizes:
+        spJ, F = jacobian(n)
+        factor = jit(partial(linalg.factor, method="gmres"))
+        rows = [("factor", linalg.spilu, factor, (spJ, )),
+                ("step", ilu_step, block_step, (spJ, F))]
+        for name, old, new, fargs in rows:
+            c_old, t_old = timeit(old, *fargs, repeat=args.repeat)
+            c_new, t_new = timeit(new, *fargs, repeat=args.repeat)
+            print(f"{n:>7} {name:>12} {c_old:>5.2f}/{c_new:<6.2f}"
+                  f" {1e3 * t_old:>11.2f} {1e3 * t_new:>11.2f}"
+                  f" {t_old / t_new:>7.1f}x")
+        err = jnp.linalg.norm(linalg.spmatvec(spJ, block_step(spJ, F)) + F)
+        print(f"{n:>7} {'residual':>12} {err / jnp.linalg.norm(F):.1e}")
@@ -2,13 +2,18 @@ import logging
 import os
 
 from deltapv import (simulator, materials, plotting,
-                     objects, spline, physics, util)
+                     objects, spline, physics, util, energy, compilation)
+from deltapv.compilation import enable_cache, cache_stats, warmup
+from deltapv.energy import energy_yield
 from deltapv.materials import create_material, load_material
+from deltapv.objects import SolverOptions
 from deltapv.plotting import (plot_band_diagram, plot_bars,
                               plot_charge, plot_iv_curve)
 from deltapv.simulator import (make_design, incident_light, equilibrium,
-                               simulate, eff_at_bias, empty_design,
-                               add_material, doping, contacts)
+                               simulate, simulate_batch, efficiency,
+                               efficiency_and_grad, eff_at_bias,
+                               short_circuit, open_circuit, max_power,
+                               empty_design, add_material, doping, contacts)
 from jax.config import config
 
 config.update("jax_enable_x64", True)
@@ -21,5 +26,8 @@ logging.basicConfig(format="")
 logger = logging.getLogger("deltapv")
 logger.setLevel("INFO")
 
+if os.environ.get("DPVCACHE"):
+    compilation.enable_cache(os.environ["DPVCACHE"])
+
 
 util.print_ascii()
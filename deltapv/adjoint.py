@@ -6,17 +6,23 @@ logger = logging.getLogger("deltapv")
 
 PVCell = objects.PVCell
 Potentials = objects.Potentials
+SolverOptions = objects.SolverOptions
 Array = util.Array
 f64 = util.f64
 
 
-def solve_pdd(cell: PVCell, v: f64, pot_ini: Potentials):
+def solve_pdd(cell: PVCell,
+              v: f64,
+              pot_ini: Potentials,
+              opts: SolverOptions = SolverOptions()):
     """Solve PDD system at a specified voltage, with IFT for gradient
 
     Args:
         cell (PVCell): An initialized cell
         v (f64): Voltage to solve at, in dimensionless form
         pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
 
     Returns:
         (f64, Potentials): Tuple of current found, in dimensionless form,
@@ -26,7 +32,7 @@ def solve_pdd(cell: PVCell, v: f64, pot_ini: Potentials):
     bound = bcond.boundary(cell, v)
 
     # Solve system
-    pot = solver.solve(cell, bound, pot_ini)
+    pot = solver.solve(cell, bound, pot_ini, opts)
 
     # Compute total current
     flux = current.total_current(cell, pot)
@@ -34,14 +40,53 @@ def solve_pdd(cell: PVCell, v: f64, pot_ini: Potentials):
     return flux, pot
 
 
+def solve_pdd_reuse(cell: PVCell,
+                    v: f64,
+                    pot_ini: Potentials,
+                    aux_ini: dict = None,
+                    opts: SolverOptions = SolverOptions()):
+    """Solve PDD system at a specified voltage, with IFT for gradient, passing
+    the kept Jacobian and factorization of the chord and Broyden variants on
+    to the next voltage
+
+    Args:
+        cell (PVCell): An initialized cell
+        v (f64): Voltage to solve at, in dimensionless form
+        pot_ini (Potentials): Initial guess of solution
+        aux_ini (dict, optional): Jacobian and factorization returned by the
+            solve at a previous voltage. Defaults to None.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        (f64, Potentials, dict): Tuple of current found, in dimensionless
+        form, solution, and Jacobian and factorization for the next solve
+    """
+    # Determine boundary conditions
+    bound = bcond.boundary(cell, v)
+
+    # Solve system
+    pot, aux = solver.solve_reuse(cell, bound, pot_ini, aux_ini, opts)
+
+    # Compute total current
+    flux = current.total_current(cell, pot)
+
+    return flux, pot, aux
+
+
 @custom_jvp
-def solve_pdd_adjoint(cell: PVCell, v: f64, pot_ini: Potentials):
+def solve_pdd_adjoint(cell: PVCell,
+                      v: f64,
+                      pot_ini: Potentials,
+                      opts: SolverOptions = SolverOptions()):
     """Solve PDD system at a specified voltage, with adjoint method for gradient
 
     Args:
         cell (PVCell): An initialized cell
         v (f64): Voltage to solve at, in dimensionless form
         pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
 
     Returns:
         (f64, Potentials): Tuple of current found, in dimensionless form,
@@ -51,7 +96,7 @@ def solve_pdd_adjoint(cell: PVCell, v: f64, pot_ini: Potentials):
     bound = bcond.boundary(cell, v)
 
     # Solve system
-    pot = solver.solve(cell, bound, pot_ini)
+    pot = solver.solve(cell, bound, pot_ini, opts)
 
     # Compute total current
     flux = current.total_current(cell, pot)
@@ -87,12 +132,12 @@ def solve_pdd_adjoint_jvp(primals, tangents):
     Returns:
         Tuple: Value and tangent of PDD system solution
     """
-    cell, v, pot_ini = primals
-    dcell, _, _ = tangents
+    cell, v, pot_ini, opts = primals
+    dcell, _, _, _ = tangents
 
     # Solve forward problem
     bound = bcond.boundary(cell, v)
-    pot = solver.solve(cell, bound, pot_ini)
+    pot, aux = solver.solve_aux(cell, bound, pot_ini, opts)
     flux = current.total_current(cell, pot)
 
     # Compute gradients with adjoint method
@@ -105,10 +150,14 @@ def solve_pdd_adjoint_jvp(primals, tangents):
     gx_pot = jacrev(current.total_current, argnums=1)(cell, pot)
     gx = solver.pot2vec(gx_pot)  # vector form
 
+    # Reuse the factorization of the last Newton iteration for the adjoint,
+    # unless chord or Broyden iterations may have kept it for several
+    # iterations
     spFx = residual.comp_F_deriv(cell, bound, pot)
-    FxT = linalg.sparse2dense(spFx).T
-
-    lam = jnp.linalg.solve(FxT, gx)
+    fact = aux["fact"]
+    if opts.newton != "full":
+        fact = linalg.factor(spFx, opts.linsol)
+    lam = linalg.reftsol(spFx, fact, gx, 1e-12, opts.linsol)
 
     dg = delg - jnp.dot(lam, delF)  # total derivative
 
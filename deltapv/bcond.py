@@ -94,6 +94,46 @@ def contact_phip_deriv(cell: PVCell,
             dJp_phi_maindiag[-1], dJp_phi_upperdiag[-1] + cell.Spr * p[-1])
 
 
+def contact_phin_and_deriv(
+        cell: PVCell, bound: Boundary, n: Array, Jn: Array,
+        DJn: Tuple[Array, Array, Array, Array]
+) -> Tuple[Tuple[f64, f64], Tuple[f64, ...]]:
+
+    # contact_phin and contact_phin_deriv from the electron density and
+    # current with its derivatives, as given by physics.carriers and
+    # current.Jn_and_deriv
+    dJn_phin_maindiag, dJn_phin_upperdiag, dJn_phi_maindiag, \
+        dJn_phi_upperdiag = DJn
+
+    return (Jn[0] - cell.Snl * (n[0] - bound.neq0),
+            Jn[-1] + cell.Snr * (n[-1] - bound.neqL)), (
+                dJn_phin_maindiag[0] - cell.Snl * n[0], dJn_phin_upperdiag[0],
+                dJn_phi_maindiag[0] - cell.Snl * n[0], dJn_phi_upperdiag[0],
+                dJn_phin_maindiag[-1],
+                dJn_phin_upperdiag[-1] + cell.Snr * n[-1],
+                dJn_phi_maindiag[-1], dJn_phi_upperdiag[-1] + cell.Snr * n[-1])
+
+
+def contact_phip_and_deriv(
+        cell: PVCell, bound: Boundary, p: Array, Jp: Array,
+        DJp: Tuple[Array, Array, Array, Array]
+) -> Tuple[Tuple[f64, f64], Tuple[f64, ...]]:
+
+    # contact_phip and contact_phip_deriv from the hole density and current
+    # with its derivatives, as given by physics.carriers and
+    # current.Jp_and_deriv
+    dJp_phip_maindiag, dJp_phip_upperdiag, dJp_phi_maindiag, \
+        dJp_phi_upperdiag = DJp
+
+    return (Jp[0] + cell.Spl * (p[0] - bound.peq0),
+            Jp[-1] - cell.Spr * (p[-1] - bound.peqL)), (
+                dJp_phip_maindiag[0] - cell.Spl * p[0], dJp_phip_upperdiag[0],
+                dJp_phi_maindiag[0] - cell.Spl * p[0], dJp_phi_upperdiag[0],
+                dJp_phip_maindiag[-1],
+                dJp_phip_upperdiag[-1] + cell.Spr * p[-1],
+                dJp_phi_maindiag[-1], dJp_phi_upperdiag[-1] + cell.Spr * p[-1])
+
+
 def contact_phi(cell: PVCell, bound: Boundary,
                 pot: Potentials) -> Tuple[f64, f64]:
 
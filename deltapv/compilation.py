@@ -0,0 +1,167 @@
+from deltapv import (objects, solver, bcond, residual, mesh, simulator,
+                     util)
+from jax import numpy as jnp, config, monitoring
+from jax.experimental.compilation_cache import compilation_cache
+from typing import List, Union
+import numpy as np
+import os
+import time
+
+import logging
+logger = logging.getLogger("deltapv")
+
+SolverOptions = objects.SolverOptions
+Material = objects.Material
+f64 = util.f64
+i64 = util.i64
+
+EVENTS = {
+    "/jax/compilation_cache/compile_requests_use_cache": "requests",
+    "/jax/compilation_cache/cache_hits": "hits",
+    "/jax/compilation_cache/cache_misses": "misses"
+}
+counts = dict.fromkeys(EVENTS.values(), 0)
+
+
+def count(event: str, **kwargs):
+
+    if event in EVENTS:
+        counts[EVENTS[event]] += 1
+
+
+monitoring.register_event_listener(count)
+
+
+def enable_cache(path: str = None, min_compile_time: f64 = 0.1):
+    """Keep compiled kernels in an on-disk cache shared by all processes
+
+    Kernels are only written to and read from the cache on platforms for
+    which JAX supports persistent compilation caching. Also enabled on
+    import if the environment variable DPVCACHE holds a directory.
+
+    Args:
+        path (str, optional): Directory of the cache. Defaults to
+            ~/.cache/deltapv.
+        min_compile_time (f64, optional): Only kernels taking at least this
+            many seconds to compile are written. Defaults to 0.1.
+    """
+    if path is None:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "deltapv")
+    os.makedirs(path, exist_ok=True)
+
+    # The cache is set up once, on the first compilation, so it is reset in
+    # case anything was compiled before
+    compilation_cache.reset_cache()
+    compilation_cache.initialize_cache(path)
+    config.update("jax_persistent_cache_min_compile_time_secs",
+                  min_compile_time)
+    logger.info(f"Using compilation cache in {path}.")
+
+
+def cache_stats() -> dict:
+    """Persistent compilation cache statistics of this process
+
+    Returns:
+        dict: Number of compilations that looked up the cache ("requests"),
+            found their kernel in it ("hits") and wrote their kernel to it
+            ("misses")
+    """
+    return dict(counts)
+
+
+def kernels(cell: objects.PVCell, opts: SolverOptions) -> List[tuple]:
+
+    # Solver kernels for a cell with the arguments they are called with, so
+    # that the compiled kernels are found by the calls of the solves
+    bound_eq = bcond.boundary_eq(cell)
+    pot_eq = solver.eq_guess(cell, bound_eq)
+    bound = bcond.boundary(cell, 0.)
+    pot = solver.ooe_guess(cell, pot_eq)
+
+    if opts.compiled:
+        return [(solver.newton_eq, (cell, bound_eq, pot_eq, opts), {}),
+                (solver.newton, (cell, bound, pot, opts), {})]
+
+    size = 3 * cell.Eg.size
+    if opts.newton == "full":
+        step = (solver.step, (cell, bound, pot, jnp.zeros(size),
+                              jnp.zeros(size)), {"opts": opts})
+    else:
+        stats = solver.reuse_ini(cell, bound, pot, opts)
+        step = (solver.step_reuse, (cell, bound, pot, stats), {"opts": opts})
+
+    return [(solver.step_eq, (cell, bound_eq, pot_eq, opts), {}), step,
+            (residual.comp_F, (cell, bound, pot), {}),
+            (residual.comp_F_deriv, (cell, bound, pot), {}),
+            (residual.comp_F_eq_deriv, (cell, bound_eq, pot_eq), {})]
+
+
+def warmup(n_points: Union[i64, List[i64]],
+           opts: SolverOptions = SolverOptions(),
+           verbose: bool = True) -> dict:
+    """Compile the solver kernels for grids of the given sizes ahead of the
+    first solve
+
+    The Newton steps of the equilibrium and out-of-equilibrium systems, or
+    their compiled Newton loops and the compiled IV sweep if opts.compiled
+    is set, are lowered and compiled for cells of each size, padded if
+    opts.bucket is set, and for their coarser grids if opts.levels is set.
+    With the compilation cache enabled (see enable_cache), later processes
+    load these kernels from disk instead of compiling them again.
+
+    Args:
+        n_points (Union[i64, List[i64]]): Number of grid points, or a list
+            of them
+        opts (SolverOptions, optional): Newton solver configuration of the
+            solves to come. Defaults to SolverOptions().
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+
+    Returns:
+        dict: Dictionary of results: "time" is the compilation time in s of
+            each size, and "requests", "hits" and "misses" are the
+            compilation cache statistics of the warm-up, see cache_stats
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    # Any integer scalar, e.g. a np.int64 from mesh.bucket, is one size
+    if np.ndim(n_points) == 0:
+        n_points = [n_points]
+    start = cache_stats()
+    times = []
+
+    for n in n_points:
+        logger.info(f"Compiling solver kernels for {n} points...")
+        tic = time.perf_counter()
+        design = simulator.make_design(n_points=n,
+                                       Ls=[1e-4, 1e-4],
+                                       mats=Material(),
+                                       Ns=[1e17, -1e17],
+                                       Snl=1e7,
+                                       Snr=0,
+                                       Spl=0,
+                                       Spr=1e7)
+        cell = simulator.make_cell(design, jnp.zeros(n), opts.bucket)
+        todo = [(simulator.sweep, (cell, solver.eq_guess(
+            cell, bcond.boundary_eq(cell)), None, False, opts),
+                 {})] if opts.compiled else []
+
+        for _ in range(mesh.levels(cell, opts.levels) + 1):
+            todo.extend(kernels(cell, opts))
+            cell = mesh.coarsen(cell)
+
+        for kernel, args, kwargs in todo:
+            kernel.lower(*args, **kwargs).compile()
+        times.append(time.perf_counter() - tic)
+
+    stats = {key: counts[key] - start[key] for key in counts}
+    logger.info(
+        "Compiled kernels in {:.1f} s, compilation cache: {} requests, {} "
+        "hits, {} misses.".format(sum(times), stats["requests"],
+                                  stats["hits"], stats["misses"]))
+
+    if not verbose:
+        logger.setLevel(temp)
+
+    return dict(stats, time=times)
@@ -169,10 +169,95 @@ def Jp_deriv(cell: PVCell, pot: Potentials) -> Tuple[Array, Array,
     return DJpDphi_p0, DJpDphi_p1, DJpDphi0, DJpDphi1
 
 
+def Jn_and_deriv(cell: PVCell, pot: Potentials, exppsi_n: Array,
+                 expphi_n: Array) -> Tuple[Array, Tuple[Array, Array, Array,
+                                                        Array]]:
+
+    # Jn and Jn_deriv from exp(psi_n) and exp(phi_n) at each node, as given
+    # by physics.carriers, and exp(Dpsin) in each interval, with Q written
+    # as exp(psi_n0) * Dpsin / (exp(Dpsin) - 1)
+    mn0 = cell.mn[:-1]
+    fm = expphi_n[1:] - expphi_n[:-1]
+
+    psi_n = cell.Chi + jnp.log(cell.Nc) + pot.phi
+    Dpsin = psi_n[:-1] - psi_n[1:]
+    exppsi_n0 = exppsi_n[:-1]
+
+    # AVOID NANS
+    taylor = jnp.abs(Dpsin) < 1e-5
+    Dpsin_norm = jnp.where(taylor, 1e-5, Dpsin)
+    Dpsin_taylor = jnp.clip(Dpsin, -1e-5, 1e-5)
+
+    expDpsin = jnp.exp(Dpsin_norm)
+    g = exppsi_n0 / (expDpsin - 1)
+    r = Dpsin_norm * expDpsin / (expDpsin - 1)
+    den = 1 + Dpsin_taylor / 2 + Dpsin_taylor**2 / 6
+
+    Q = jnp.where(taylor, exppsi_n0 / den, g * Dpsin_norm)
+    DQDphi0 = jnp.where(
+        taylor, exppsi_n0 * (1 / 2 + Dpsin / 6 + Dpsin**2 / 6) / den**2,
+        g * (Dpsin_norm + 1 - r))
+    DQDphi1 = jnp.where(taylor, exppsi_n0 * (1 / 2 + Dpsin / 3) / den**2,
+                        g * (r - 1))
+
+    Jn = mn0 * Q * fm / cell.dgrid
+    DJnDphi_n0 = -mn0 * Q / cell.dgrid * expphi_n[:-1]
+    DJnDphi_n1 = mn0 * Q / cell.dgrid * expphi_n[1:]
+    DJnDphi0 = mn0 * fm / cell.dgrid * DQDphi0
+    DJnDphi1 = mn0 * fm / cell.dgrid * DQDphi1
+
+    return Jn, (DJnDphi_n0, DJnDphi_n1, DJnDphi0, DJnDphi1)
+
+
+def Jp_and_deriv(cell: PVCell, pot: Potentials, expmpsi_p: Array,
+                 expmphi_p: Array) -> Tuple[Array, Tuple[Array, Array, Array,
+                                                         Array]]:
+
+    # Jp and Jp_deriv from exp(-psi_p) and exp(-phi_p) at each node, as
+    # given by physics.carriers, and exp(-Dpsip) in each interval, with Q
+    # written as exp(-psi_p0) * Dpsip / (exp(-Dpsip) - 1)
+    mp0 = cell.mp[:-1]
+    fm = expmphi_p[1:] - expmphi_p[:-1]
+
+    psi_p = cell.Chi + cell.Eg - jnp.log(cell.Nv) + pot.phi
+    Dpsip = psi_p[:-1] - psi_p[1:]
+    expmpsi_p0 = expmpsi_p[:-1]
+
+    # AVOID NANS
+    taylor = jnp.abs(Dpsip) < 1e-5
+    Dpsip_norm = jnp.where(taylor, 1e-5, Dpsip)
+    Dpsip_taylor = jnp.clip(Dpsip, -1e-5, 1e-5)
+
+    expmDpsip = jnp.exp(-Dpsip_norm)
+    g = expmpsi_p0 / (expmDpsip - 1)
+    r = Dpsip_norm * expmDpsip / (expmDpsip - 1)
+    den = -1 + Dpsip_taylor / 2 - Dpsip_taylor**2 / 6
+
+    Q = jnp.where(taylor, expmpsi_p0 / den, g * Dpsip_norm)
+    DQDphi0 = jnp.where(
+        taylor, -expmpsi_p0 / den - expmpsi_p0 * (1 / 2 - Dpsip / 3) / den**2,
+        g * (1 - Dpsip_norm + r))
+    DQDphi1 = jnp.where(taylor, expmpsi_p0 * (1 / 2 - Dpsip / 3) / den**2,
+                        -g * (1 + r))
+
+    Jp = mp0 * Q * fm / cell.dgrid
+    DJpDphi_p0 = mp0 * Q / cell.dgrid * expmphi_p[:-1]
+    DJpDphi_p1 = -mp0 * Q / cell.dgrid * expmphi_p[1:]
+    DJpDphi0 = mp0 * fm / cell.dgrid * DQDphi0
+    DJpDphi1 = mp0 * fm / cell.dgrid * DQDphi1
+
+    return Jp, (DJpDphi_p0, DJpDphi_p1, DJpDphi0, DJpDphi1)
+
+
 def total_current(cell: PVCell, pot: Potentials) -> f64:
 
     Jtotal = Jn(cell, pot) + Jp(cell, pot)
-    curr = jnp.mean(Jtotal)
+    if cell.mask is None:
+        return jnp.mean(Jtotal)
+
+    # Mean over the intervals of a padded cell between two of its own nodes
+    inside = cell.mask[:-1] * cell.mask[1:]
+    curr = jnp.sum(jnp.where(inside > 0, Jtotal, 0)) / jnp.sum(inside)
 
     return curr
 
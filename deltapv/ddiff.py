@@ -84,3 +84,65 @@ def ddn_deriv(
 
     return (dde_phin_, dde_phin__, dde_phin___, dde_phip__,
             dde_phi_, dde_phi__, dde_phi___)
+
+
+def ddn_and_deriv(cell: PVCell, R: Array, DR: Tuple[Array, Array, Array],
+                  Jn: Array, DJn: Tuple[Array, Array, Array, Array]
+                  ) -> Tuple[Array, Tuple[Array, ...]]:
+
+    # ddn and ddn_deriv from the recombination and electron current with
+    # their derivatives, as given by recomb.all_recomb_and_deriv and
+    # current.Jn_and_deriv
+    DR_phin, DR_phip, DR_phi = DR
+    dJn_phin_maindiag, dJn_phin_upperdiag, dJn_phi_maindiag, \
+        dJn_phi_upperdiag = DJn
+
+    ave_dgrid = (cell.dgrid[:-1] + cell.dgrid[1:]) / 2.
+
+    ddn = -R[1:-1] + cell.G[1:-1] + jnp.diff(Jn) / ave_dgrid
+
+    dde_phin_ = -dJn_phin_maindiag[:-1] / ave_dgrid
+    dde_phin__ = (-dJn_phin_upperdiag[:-1] +
+                  dJn_phin_maindiag[1:]) / ave_dgrid - DR_phin[1:-1]
+    dde_phin___ = dJn_phin_upperdiag[1:] / ave_dgrid
+
+    dde_phi_ = -dJn_phi_maindiag[:-1] / ave_dgrid
+    dde_phi__ = (-dJn_phi_upperdiag[:-1] +
+                 dJn_phi_maindiag[1:]) / ave_dgrid - DR_phi[1:-1]
+    dde_phi___ = dJn_phi_upperdiag[1:] / ave_dgrid
+
+    dde_phip__ = -DR_phip[1:-1]
+
+    return ddn, (dde_phin_, dde_phin__, dde_phin___, dde_phip__, dde_phi_,
+                 dde_phi__, dde_phi___)
+
+
+def ddp_and_deriv(cell: PVCell, R: Array, DR: Tuple[Array, Array, Array],
+                  Jp: Array, DJp: Tuple[Array, Array, Array, Array]
+                  ) -> Tuple[Array, Tuple[Array, ...]]:
+
+    # ddp and ddp_deriv from the recombination and hole current with their
+    # derivatives, as given by recomb.all_recomb_and_deriv and
+    # current.Jp_and_deriv
+    DR_phin, DR_phip, DR_phi = DR
+    dJp_phip_maindiag, dJp_phip_upperdiag, dJp_phi_maindiag, \
+        dJp_phi_upperdiag = DJp
+
+    ave_dgrid = (cell.dgrid[:-1] + cell.dgrid[1:]) / 2.
+
+    ddp = R[1:-1] - cell.G[1:-1] + jnp.diff(Jp) / ave_dgrid
+
+    ddp_phip_ = -dJp_phip_maindiag[:-1] / ave_dgrid
+    ddp_phip__ = (-dJp_phip_upperdiag[:-1] +
+                  dJp_phip_maindiag[1:]) / ave_dgrid + DR_phip[1:-1]
+    ddp_phip___ = dJp_phip_upperdiag[1:] / ave_dgrid
+
+    ddp_phi_ = -dJp_phi_maindiag[:-1] / ave_dgrid
+    ddp_phi__ = (-dJp_phi_upperdiag[:-1] +
+                 dJp_phi_maindiag[1:]) / ave_dgrid + DR_phi[1:-1]
+    ddp_phi___ = dJp_phi_upperdiag[1:] / ave_dgrid
+
+    ddp_phin__ = DR_phin[1:-1]
+
+    return ddp, (ddp_phin__, ddp_phip_, ddp_phip__, ddp_phip___, ddp_phi_,
+                 ddp_phi__, ddp_phi___)
@@ -0,0 +1,134 @@
+from deltapv import (objects, scales, optical, solver, current,
+                     simulator, util)
+from jax import numpy as jnp
+import numpy as np
+import csv
+
+import logging
+logger = logging.getLogger("deltapv")
+
+PVDesign = objects.PVDesign
+SolverOptions = objects.SolverOptions
+Array = util.Array
+f64 = util.f64
+
+FIELDS = ["condition", "irradiance", "jsc", "voc", "mpp", "vmax", "eff"]
+
+
+def energy_yield(design: PVDesign,
+                 Lambda: Array,
+                 spectra: Array,
+                 hours: Array = 1.,
+                 optics: bool = True,
+                 path: str = None,
+                 verbose: bool = True,
+                 opts: SolverOptions = SolverOptions()) -> dict:
+    """Energy yield of a cell over many illumination conditions, e.g. the
+    hourly spectra of a year
+
+    The equilibrium solution and the generation basis of the design are
+    computed once. Conditions are solved in order of increasing irradiance,
+    each starting from the short circuit, open circuit and maximum power
+    solutions of the previous one, which is the nearest in irradiance.
+    Conditions without light are skipped and reported as zero, in the
+    results and in the CSV file, which has a row for every condition.
+
+    Args:
+        design (PVDesign): A cell
+        Lambda (Array): Wavelengths in nm shared by all spectra
+        spectra (Array): Incident power in W/m^2 at each wavelength, with
+            shape (n_conditions, n_lambda)
+        hours (Array, optional): Duration of each condition in hours, a
+            scalar or an array of shape (n_conditions, ). Defaults to 1.
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        path (str, optional): CSV file to which the results of each
+            condition are written as soon as it is solved. Defaults to None.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of results, in the order of the conditions given:
+            "irradiance" in W/m^2, "jsc" the short circuit current in
+            A/cm^2, "voc" the open circuit voltage in V, "mpp" the maximum
+            power in W/m^2, "vmax" its voltage in V and "eff" the power
+            conversion efficiency, and "energy" the total energy yield in
+            Wh/m^2
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    spectra = np.asarray(spectra, dtype=np.float64)
+    n_cond = spectra.shape[0]
+    irradiance = spectra.sum(axis=1)
+    results = {key: np.zeros(n_cond) for key in FIELDS[2:]}
+    results["irradiance"] = irradiance
+
+    pot_eq = simulator.equilibrium(design, None, opts)
+    basis = optical.generation_basis(design, jnp.asarray(Lambda), optics)
+
+    stream = open(path, "w", newline="") if path is not None else None
+    try:
+        if stream is not None:
+            writer = csv.writer(stream)
+            writer.writerow(FIELDS)
+            for k in np.flatnonzero(irradiance <= 0):
+                writer.writerow([k, irradiance[k]] + [0.] * len(FIELDS[2:]))
+            stream.flush()
+
+        prev = None
+        order = [k for k in np.argsort(irradiance) if irradiance[k] > 0]
+        for i, k in enumerate(order):
+            logger.info(
+                "Solving condition {} ({}/{}) at {:.1f} W/m^2...".format(
+                    k, i + 1, len(order), irradiance[k]))
+            G = optical.basis_G(basis, spectra[k])
+            cell = simulator.make_cell(design, G, opts.bucket)
+
+            if prev is None:
+                guess = solver.ooe_guess_seq(cell, pot_eq, opts)
+                warm_oc = warm_mp = None
+            else:
+                guess, warm_oc, warm_mp = prev
+
+            # Short circuit is solved once for both searches
+            sc = simulator.vprobe(cell, 0., guess, None, opts)
+            j, pot_sc = sc[0], sc[2]
+            voc, _, pot_oc = simulator.vsearch(cell, pot_sc, "voc", opts,
+                                               warm_oc, sc)
+            vmax, _, pot_mp = simulator.vsearch(cell, pot_sc, "mpp", opts,
+                                                warm_mp, sc)
+            jmax = current.total_current(cell, pot_mp)
+            prev = pot_sc, (voc, pot_oc), (vmax, pot_mp)
+
+            pmax = vmax * scales.energy * jmax * scales.current * 1e4
+            row = {
+                "jsc": j * scales.current,
+                "voc": voc * scales.energy,
+                "mpp": pmax,
+                "vmax": vmax * scales.energy,
+                "eff": pmax / irradiance[k]
+            }
+            for key, value in row.items():
+                results[key][k] = float(value)
+
+            if stream is not None:
+                writer.writerow([k, irradiance[k]] +
+                                [results[key][k] for key in FIELDS[2:]])
+                stream.flush()
+
+        results["energy"] = float(np.sum(results["mpp"] * hours))
+        logger.info("Finished energy yield of {:.1f} Wh/m^2.".format(
+            results["energy"]))
+
+    finally:
+        # The file is closed and the log level restored even if a solve
+        # fails, e.g. with the SystemExit of the dense fallback
+        if stream is not None:
+            stream.close()
+        if not verbose:
+            logger.setLevel(temp)
+
+    return results
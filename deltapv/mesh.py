@@ -0,0 +1,304 @@
+from deltapv import objects, scales, util
+from jax import numpy as jnp, tree_util
+from typing import List, Union
+import numpy as np
+
+PVCell = objects.PVCell
+PVDesign = objects.PVDesign
+Potentials = objects.Potentials
+Material = objects.Material
+Array = util.Array
+f64 = util.f64
+i64 = util.i64
+MIN_NODES = 50
+N_SAMPLES = 1000
+TOL_JUMP = 1.
+MIN_LAYER = 8
+
+
+def coarse_idx(n: i64) -> np.ndarray:
+
+    # Every other node, always keeping both contacts. Only depends on the
+    # number of nodes, so that coarsening works on traced cells.
+    idx = np.arange(0, n, 2)
+    if idx[-1] != n - 1:
+        idx = np.append(idx, n - 1)
+
+    return idx
+
+
+def nodes(cell: PVCell) -> Array:
+
+    return jnp.concatenate([jnp.zeros(1), jnp.cumsum(cell.dgrid)])
+
+
+def coarsen(cell: PVCell) -> PVCell:
+
+    n = cell.Eg.size
+    idx = coarse_idx(n)
+
+    def subsample(x):
+        if jnp.ndim(x) == 1 and x.size == n:
+            return x[idx]
+        return x
+
+    coarse = tree_util.tree_map(subsample, cell)
+
+    return objects.update(coarse, dgrid=jnp.diff(nodes(cell)[idx]))
+
+
+def restrict(pot: Potentials) -> Potentials:
+
+    idx = coarse_idx(pot.phi.size)
+
+    return tree_util.tree_map(lambda x: x[idx], pot)
+
+
+def prolong(pot: Potentials, cell: PVCell) -> Potentials:
+
+    # Linear interpolation of a solution on coarsen(cell) to the nodes of
+    # cell
+    x = nodes(cell)
+    xc = x[coarse_idx(x.size)]
+
+    return tree_util.tree_map(lambda y: jnp.interp(x, xc, y), pot)
+
+
+def levels(cell: PVCell, n_levels: i64) -> i64:
+
+    # Number of coarsenings actually applied, stopping before a grid of
+    # fewer than MIN_NODES nodes
+    n, k = cell.Eg.size, 0
+    while k < n_levels and coarse_idx(n).size >= MIN_NODES:
+        n, k = coarse_idx(n).size, k + 1
+
+    return k
+
+
+def debye_length(mat: Material, N: f64) -> f64:
+
+    # Extrinsic Debye length in cm, or intrinsic for undoped layers
+    ni = np.sqrt(mat.Nc * mat.Nv) * np.exp(-mat.Eg / (2 * scales.energy))
+    density = max(abs(N), ni)
+
+    return float(np.sqrt(mat.eps * scales.eps0 * scales.energy /
+                         (scales.q * density)))
+
+
+def graded_grid(n_points: i64,
+                Ls: List[f64],
+                mats: Union[List[Material], Material],
+                Ns: List[f64],
+                resolution: f64 = 4.,
+                grading: f64 = 0.2) -> Array:
+    """Grid with nodes concentrated at the interfaces and contacts
+
+    The target node spacing at each interface and contact is a fraction of
+    the smallest Debye length of the layers meeting there, and grows
+    linearly with the distance from it. The n_points nodes are then placed
+    so that they follow this spacing, with a node on every interface.
+
+    Args:
+        n_points (i64): Number of points
+        Ls (List[f64]): Thicknesses of each layer
+        mats (Union[List[Material], Material]): List of materials
+        Ns (List[f64]): List of doping densities
+        resolution (f64, optional): Target number of nodes per Debye length
+            at interfaces and contacts. Defaults to 4.
+        grading (f64, optional): Growth of the target spacing per unit
+            distance from the nearest interface or contact, at most 1 for
+            a smooth grid. Defaults to 0.2.
+
+    Returns:
+        Array: Discretized coordinates in cm
+    """
+    if isinstance(mats, Material):
+        mats = [mats] * len(Ls)
+    edges = np.concatenate([[0], np.cumsum(Ls)])
+    lengths = [debye_length(mat, N) for mat, N in zip(mats, Ns)]
+    lengths = [lengths[0]] + [
+        min(left, right) for left, right in zip(lengths[:-1], lengths[1:])
+    ] + [lengths[-1]]
+
+    # Node density, the inverse of the target spacing, sampled in each
+    # layer and integrated
+    layers = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        x = np.linspace(start, end, N_SAMPLES)
+        h = np.min([lam / resolution + grading * np.abs(x - edge)
+                    for edge, lam in zip(edges, lengths)], axis=0)
+        h = np.minimum(h, edges[-1] / 10)
+        w = 1 / h
+        cum = np.concatenate(
+            [[0], np.cumsum((w[1:] + w[:-1]) / 2 * np.diff(x))])
+        layers.append((x, cum))
+
+    # Intervals per layer by largest remainder, at least one each
+    total = np.array([cum[-1] for _, cum in layers])
+    share = (n_points - 1) * total / total.sum()
+    counts = np.maximum(np.floor(share).astype(int), 1)
+    for k in np.argsort(counts - share)[:max(n_points - 1 - counts.sum(),
+                                            0)]:
+        counts[k] += 1
+
+    grid = [np.zeros(1)]
+    for (x, cum), count in zip(layers, counts):
+        grid.append(np.interp(np.linspace(0, cum[-1], count + 1), cum, x)[1:])
+
+    return jnp.array(np.concatenate(grid))
+
+
+def bucket(n: i64) -> i64:
+
+    # Smallest size of at least n among eight sizes per octave, so that
+    # refined grids reuse a small set of array shapes
+    step = 2**max(int(np.log2(n)) - 3, 0)
+
+    return -(-n // step) * step
+
+
+def bucket_below(n: i64) -> i64:
+
+    # Largest bucket size of at most n
+    step = 2**max(int(np.log2(n)) - 3, 0)
+
+    return n // step * step
+
+
+def jumps(pots: List[Potentials]) -> np.ndarray:
+
+    # Discretization error indicator of each interval: the largest change of
+    # the electrostatic potential or either quasi-Fermi energy across it, in
+    # units of kT, over all solutions given
+    return np.max([
+        np.abs(np.diff(np.asarray(x))) for pot in pots
+        for x in (pot.phi, pot.phi_n, pot.phi_p)
+    ], axis=0)
+
+
+def thin(design: PVDesign) -> np.ndarray:
+
+    # Intervals in or bounding a layer of fewer than MIN_LAYER nodes, where a
+    # layer is a run of nodes with the same material and doping. Such layers
+    # are underresolved however smooth the solutions are across them.
+    n = design.grid.size
+    fields = [
+        np.asarray(value) for key, value in design.__dict__.items()
+        if key != "grid" and np.ndim(value) == 1 and np.size(value) == n
+    ]
+    edge = np.any([x[1:] != x[:-1] for x in fields], axis=0)
+    layer = np.concatenate([[0], np.cumsum(edge)])
+    small = np.bincount(layer)[layer] < MIN_LAYER
+
+    return small[:-1] | small[1:]
+
+
+def refine(design: PVDesign,
+           pots: List[Potentials],
+           tol: f64 = TOL_JUMP) -> tuple:
+    """Bisect the intervals of a design where solutions change too much
+    between nodes
+
+    Every interval whose indicator (see jumps) exceeds tol is bisected, as
+    is every interval of a layer with too few nodes (see thin). The
+    intervals with the next largest indicators are bisected as well until
+    the number of nodes reaches a bucket size, which is at most the size
+    with every interval bisected. New nodes take the material
+    and doping of the node to their left.
+
+    Args:
+        design (PVDesign): A cell
+        pots (List[Potentials]): Solutions on the grid of the design
+        tol (f64, optional): Largest change of the potentials across an
+            interval in units of kT. Defaults to TOL_JUMP.
+
+    Returns:
+        (PVDesign, List[Potentials]): Refined design, unchanged if no
+        interval needs refinement, and the solutions interpolated onto its
+        grid
+    """
+    grid = np.asarray(design.grid)
+    n = grid.size
+    indicator = jumps(pots)
+    indicator[thin(design)] = np.inf
+    n_marked = int(np.sum(indicator > tol))
+    if n_marked == 0:
+        return design, pots
+
+    # At most every interval is bisected, and the refined grid keeps a
+    # bucket size so that it shares compiled kernels with other grids
+    n_new = min(bucket(n + n_marked), bucket_below(2 * n - 1)) - n
+    split = np.zeros(n - 1, dtype=bool)
+    split[np.argsort(-indicator)[:n_new]] = True
+
+    # Index of the node to the left of each node of the refined grid
+    src = np.repeat(np.arange(n), np.append(1 + split, 1))
+    mid = (grid[:-1] + grid[1:])[split] / 2
+    new_grid = np.sort(np.concatenate([grid, mid]))
+
+    def resample(x):
+        if jnp.ndim(x) == 1 and x.size == n:
+            return x[src]
+        if jnp.ndim(x) == 2 and x.shape[1] == n:
+            return x[:, src]
+        return x
+
+    refined = tree_util.tree_map(resample, design)
+    refined = objects.update(refined, grid=jnp.array(new_grid))
+    pots = [
+        tree_util.tree_map(lambda y: jnp.interp(new_grid, grid, y), pot)
+        for pot in pots
+    ]
+
+    return refined, pots
+
+
+def pad(cell: PVCell, size: i64) -> PVCell:
+
+    # Cell extended to size nodes by repeating its last node and interval.
+    # The mask is one on the nodes of the cell and zero on the padding, whose
+    # rows of the residual are inert (see residual.comp_F), so that the
+    # solution on the other nodes is unchanged.
+    n = cell.Eg.size
+    mask = jnp.ones(n) if cell.mask is None else cell.mask
+
+    def extend(x):
+        if jnp.ndim(x) == 1 and x.size in (n - 1, n):
+            return jnp.pad(x, (0, size - n), mode="edge")
+        return x
+
+    padded = tree_util.tree_map(extend, objects.update(cell, mask=None))
+
+    return objects.update(padded, mask=jnp.pad(mask, (0, size - n)))
+
+
+def pad_pot(pot: Potentials, size: i64) -> Potentials:
+
+    n = pot.phi.size
+
+    return tree_util.tree_map(
+        lambda x: jnp.pad(x, (0, size - n), mode="edge"), pot)
+
+
+def unpad(pot: Potentials, n: i64) -> Potentials:
+
+    # Solutions on the first n nodes, also for solutions stacked along a
+    # leading axis
+    return tree_util.tree_map(lambda x: x[..., :n], pot)
+
+
+def last_node(cell: PVCell) -> i64:
+
+    return jnp.sum(cell.mask > 0) - 1
+
+
+def tail(cell: PVCell, pot: Potentials) -> tuple:
+
+    # Cell and solution rolled so that the last node of a padded cell is the
+    # last entry of every array, for the back contact conditions
+    shift = cell.mask.size - 1 - last_node(cell)
+
+    def roll(x):
+        return jnp.roll(x, shift) if jnp.ndim(x) == 1 else x
+
+    return tree_util.tree_map(roll, (cell, pot))
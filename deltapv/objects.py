@@ -61,6 +61,7 @@ class PVCell:
     Spr: f64
     PhiM0: f64
     PhiML: f64
+    mask: Array = None
 
 
 def zero_cell(n: i64) -> PVCell:
@@ -123,6 +124,49 @@ class Boundary:
     peqL: f64
 
 
+@dataclasses.dataclass
+class SolverOptions:
+    """Static configuration of the Newton solver
+
+    Every field is static, so an instance can be passed through jit and
+    custom_jvp like any other argument without being traced.
+
+    Args:
+        compiled (bool, optional): Run the whole Newton iteration on device
+            in a single lax.while_loop. Defaults to False.
+        linsol (str, optional): Linear solver for the Newton steps, one of
+            "gmres" (block-ILU-preconditioned GMRES), "block" (direct
+            block-tridiagonal LU) and "cr" (direct block cyclic reduction,
+            of logarithmic depth for long grids). Defaults to "gmres".
+        newton (str, optional): Newton variant for the out-of-equilibrium
+            system, one of "full" (new Jacobian every iteration), "chord"
+            (Jacobian and factorization kept until refreshed) and "broyden"
+            (chord with rank-one updates of the kept factorization). The
+            chord and Broyden variants also reuse the last factorization of
+            the previous voltage step. Defaults to "full".
+        refresh (float, optional): Refresh the kept Jacobian once the ratio
+            of successive step norms |p_k| / |p_k-1| exceeds this value.
+            Defaults to 0.5.
+        max_age (int, optional): Refresh the kept Jacobian after at most
+            this many iterations. Defaults to 10.
+        levels (int, optional): Number of grid sequencing levels. The
+            equilibrium system and the first out-of-equilibrium step are
+            solved on grids with every other node dropped this many times
+            first, coarsest first, and each solution interpolated as the
+            guess on the next finer grid. Defaults to 0.
+        bucket (bool, optional): Pad cells to the next bucket size (see
+            mesh.bucket) with inert nodes, so that grids of different sizes
+            share compiled kernels. Defaults to False.
+    """
+    compiled: bool = dataclasses.static_field(default=False)
+    linsol: str = dataclasses.static_field(default="gmres")
+    newton: str = dataclasses.static_field(default="full")
+    refresh: float = dataclasses.static_field(default=0.5)
+    max_age: int = dataclasses.static_field(default=10)
+    levels: int = dataclasses.static_field(default=0)
+    bucket: bool = dataclasses.static_field(default=False)
+
+
 def update(
         obj: Union[PVDesign, PVCell, Material], **kwargs) -> Union[PVDesign,
                                                                    PVCell,
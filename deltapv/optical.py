@@ -1,10 +1,15 @@
 from deltapv import objects, scales, util
-from jax import numpy as jnp, vmap
+from jax import numpy as jnp, vmap, core
+from collections import OrderedDict
+import numpy as np
+import hashlib
 
 PVDesign = objects.PVDesign
 LightSource = objects.LightSource
 Array = util.Array
 f64 = util.f64
+G_CACHE_SIZE = 32
+_G_cache = OrderedDict()
 
 
 def photonflux(ls: LightSource) -> Array:
@@ -43,21 +48,93 @@ def generation_lambda(design: PVDesign, phi_0: f64, alpha: Array) -> Array:
     return g
 
 
-def compute_G(design: PVDesign, ls: LightSource, optics: bool = True) -> Array:
+def generation_basis(design: PVDesign,
+                     Lambda: Array,
+                     optics: bool = True) -> Array:
 
-    phis = photonflux(ls)
+    # Generation density per unit incident power at each wavelength, with
+    # shape (n_lambda, N). G is linear in the incident power, so the profile
+    # for any spectrum P_in on the wavelengths Lambda is P_in @ basis, and
+    # for a matrix of spectra stacked along the first axis likewise.
+    phis = photonflux(LightSource(Lambda=Lambda, P_in=jnp.ones(Lambda.shape)))
     valpha = vmap(alpha, (None, 0))
 
     if optics:
-        alphas = valpha(design, ls.Lambda)  # 1 / m
+        alphas = valpha(design, Lambda)  # 1 / m
     else:
         alphas = vmap(jnp.interp, (None, None, 1),
-                      1)(ls.Lambda, jnp.linspace(200, 1000, 100), design.alpha)
+                      1)(Lambda, jnp.linspace(200, 1000, 100), design.alpha)
         alphas = alphas / scales.cm  # 1 / m
 
     vgenlambda = vmap(generation_lambda, (None, 0, 0))
-    all_generations = vgenlambda(design, phis, alphas)
-    tot_generation = jnp.sum(all_generations, axis=0)  # 1 / (m^3 s)
-    G_dim = tot_generation / 1e6 / scales.gratedens
+    all_generations = vgenlambda(design, phis, alphas)  # 1 / (m^3 s W/m^2)
+    basis = all_generations / 1e6 / scales.gratedens
+
+    return basis
+
+
+def basis_G(basis: Array, P_in: Array) -> Array:
+
+    # Generation density for one spectrum (n_lambda,) or many stacked along
+    # the first axis (n_spectra, n_lambda), see generation_basis
+    return jnp.dot(P_in, basis)
+
+
+def generation(design: PVDesign,
+               ls: LightSource,
+               optics: bool = True) -> Array:
+
+    basis = generation_basis(design, ls.Lambda, optics)
+    G_dim = basis_G(basis, ls.P_in)
 
     return G_dim
+
+
+def cache_key(design: PVDesign, ls: LightSource, optics: bool) -> tuple:
+
+    # Only the fields that the generation density depends on enter the key,
+    # with their dtypes and shapes, so that designs differing in electrical
+    # parameters share it. Traced values, e.g. under grad or vmap, are never
+    # cached, so gradient-based optimization (value_and_grad of efficiency,
+    # as in optimize/psc.py) always recomputes the generation density.
+    if optics:
+        fields = [design.Eg, design.A, design.grid, ls.Lambda, ls.P_in]
+    else:
+        fields = [design.alpha, design.grid, ls.Lambda, ls.P_in]
+
+    if any(isinstance(x, core.Tracer) for x in fields):
+        return None
+
+    digest = hashlib.sha1()
+    for x in fields:
+        x = np.asarray(x)
+        digest.update(x.dtype.str.encode())
+        digest.update(str(x.shape).encode())
+        digest.update(x.tobytes())
+
+    return optics, digest.hexdigest()
+
+
+def compute_G(design: PVDesign, ls: LightSource, optics: bool = True) -> Array:
+
+    # generation with the last G_CACHE_SIZE results memoized, for concrete
+    # inputs only, see cache_key
+    key = cache_key(design, ls, optics)
+    if key is None:
+        return generation(design, ls, optics)
+
+    if key in _G_cache:
+        _G_cache.move_to_end(key)
+        return _G_cache[key]
+
+    G = generation(design, ls, optics)
+    _G_cache[key] = G
+    if len(_G_cache) > G_CACHE_SIZE:
+        _G_cache.popitem(last=False)
+
+    return G
+
+
+def clear_cache():
+
+    _G_cache.clear()
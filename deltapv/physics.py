@@ -1,5 +1,6 @@
 from deltapv import objects, scales, util
 from jax import numpy as jnp, custom_jvp
+from typing import Tuple
 
 PVCell = objects.PVCell
 LightSource = objects.LightSource
@@ -42,6 +43,21 @@ def p_jvp(primals, tangents):
     return primal_out, tangent_out
 
 
+def carriers(cell: PVCell, pot: Potentials) -> Tuple[Array, Array, Array,
+                                                    Array, Array, Array]:
+
+    # n and p as products of exp(psi_n) = Nc * exp(Chi + phi), exp(phi_n),
+    # exp(-psi_p) = Nv * exp(-Chi - Eg - phi) and exp(-phi_p), which are
+    # returned as well, so that the currents share the same exponentials
+    exppsi_n = cell.Nc * jnp.exp(cell.Chi + pot.phi)
+    expphi_n = jnp.exp(pot.phi_n)
+    expmpsi_p = cell.Nv * jnp.exp(-cell.Chi - cell.Eg - pot.phi)
+    expmphi_p = jnp.exp(-pot.phi_p)
+
+    return (exppsi_n * expphi_n, expmpsi_p * expmphi_p, exppsi_n, expphi_n,
+            expmpsi_p, expmphi_p)
+
+
 def charge(cell: PVCell, pot: Potentials) -> Array:
 
     _n = n(cell, pot)
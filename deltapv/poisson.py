@@ -56,3 +56,24 @@ def pois_deriv(cell: PVCell,
     dpois_dphip__ = -dchg_phi_p[1:-1]
 
     return dpois_phi_, dpois_phi__, dpois_phi___, dpois_dphin__, dpois_dphip__
+
+
+def pois_and_deriv(cell: PVCell, pot: Potentials, n: Array,
+                   p: Array) -> Tuple[Array, Tuple[Array, ...]]:
+
+    # pois and pois_deriv from the carrier densities, as given by
+    # physics.carriers
+    ave_dgrid = (cell.dgrid[:-1] + cell.dgrid[1:]) / 2.
+    ave_eps = (cell.eps[1:] + cell.eps[:-1]) / 2.
+    chg = -n + p + cell.Ndop
+
+    pois = (ave_eps[:-1] * jnp.diff(pot.phi)[:-1] / cell.dgrid[:-1] -
+            ave_eps[1:] * jnp.diff(pot.phi)[1:] /
+            cell.dgrid[1:]) / ave_dgrid - chg[1:-1]
+
+    dpois_phi_ = -ave_eps[:-1] / cell.dgrid[:-1] / ave_dgrid
+    dpois_phi__ = (ave_eps[:-1] / cell.dgrid[:-1] + ave_eps[1:] /
+                   cell.dgrid[1:]) / ave_dgrid + n[1:-1] + p[1:-1]
+    dpois_phi___ = -ave_eps[1:] / cell.dgrid[1:] / ave_dgrid
+
+    return pois, (dpois_phi_, dpois_phi__, dpois_phi___, n[1:-1], p[1:-1])
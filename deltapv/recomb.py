@@ -28,6 +28,33 @@ def all_recomb_deriv(cell: PVCell,
     return DR_phin, DR_phip, DR_phi
 
 
+def all_recomb_and_deriv(
+        cell: PVCell, n: Array,
+        p: Array) -> Tuple[Array, Tuple[Array, Array, Array]]:
+
+    # all_recomb and all_recomb_deriv from the carrier densities, as given by
+    # physics.carriers
+    ni = physics.ni(cell)
+    np_ = n * p
+    num = np_ - ni**2
+
+    auger = cell.Cn * n + cell.Cp * p
+    nR = ni * jnp.exp(cell.Et) + n
+    pR = ni * jnp.exp(-cell.Et) + p
+    denom = cell.tp * nR + cell.tn * pR
+
+    R = auger * num + num / denom + cell.Br * num
+
+    DR_phin = (cell.Cn * n) * num + auger * np_ + (
+        np_ * denom - num * (cell.tp * n)) / denom**2 + cell.Br * np_
+    DR_phip = (-cell.Cp * p) * num - auger * np_ + (
+        -np_ * denom + num * (cell.tn * p)) / denom**2 - cell.Br * np_
+    DR_phi = (cell.Cn * n - cell.Cp * p) * num - num * (
+        cell.tp * n - cell.tn * p) / denom**2
+
+    return R, (DR_phin, DR_phip, DR_phi)
+
+
 def comp_auger(cell: PVCell, pot: Potentials) -> Array:
 
     ni = physics.ni(cell)
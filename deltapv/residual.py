@@ -1,22 +1,119 @@
-from deltapv import objects, ddiff, bcond, poisson, linalg, util
+from deltapv import (objects, physics, current, recomb, ddiff, bcond, poisson,
+                     linalg, mesh, util)
 from jax import numpy as jnp,  jit
+from typing import Tuple
 
 PVCell = objects.PVCell
 Potentials = objects.Potentials
 Boundary = objects.Boundary
 Array = util.Array
 f64 = util.f64
-
-
-@jit
-def comp_F(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
-
-    ddn = ddiff.ddn(cell, pot)
-    ddp = ddiff.ddp(cell, pot)
-    pois = poisson.pois(cell, pot)
-
-    ctct_0_phin, ctct_L_phin = bcond.contact_phin(cell, bound, pot)
-    ctct_0_phip, ctct_L_phip = bcond.contact_phip(cell, bound, pot)
+Banded = linalg.Banded
+
+# Diagonals of the Jacobians, for the unknowns phi_n, phi_p, phi of each node
+# in turn and for phi alone in equilibrium
+OFFSETS = tuple(range(-3, 6))
+OFFSETS_EQ = (-1, 0, 1)
+
+# Diagonals of the derivatives returned by ddiff.ddn_deriv, ddiff.ddp_deriv
+# and poisson.pois_deriv in the rows of their node, and by
+# bcond.contact_phin_deriv and bcond.contact_phip_deriv in the rows of the
+# first and last node
+DDN_OFFSETS = (-3, 0, 3, 1, -1, 2, 5)
+DDP_OFFSETS = (-1, -3, 0, 3, -2, 1, 4)
+POIS_OFFSETS = (-3, 0, 3, -2, -1)
+CTCT_PHIN_OFFSETS = (0, 3, 2, 5, -3, 0, -1, 2)
+CTCT_PHIP_OFFSETS = (0, 3, 1, 4, -3, 0, -2, 1)
+
+
+def band(offsets: tuple, first: Tuple[dict, ...],
+         interior: Tuple[dict, ...], last: Tuple[dict, ...]) -> Banded:
+
+    # Jacobian from the derivatives of the rows of the first, interior and
+    # last nodes, given for each unknown of a node as a dictionary from the
+    # offset of each derivative to its value, an array over the interior
+    # nodes for the interior rows. Every diagonal is a concatenation of these
+    # for each unknown, interleaved, so no indices or scatters are needed.
+    size = next(iter(interior[0].values())).size
+    diags = []
+    for k in offsets:
+        rows = [
+            jnp.concatenate([
+                jnp.reshape(front.get(k, 0.), 1),
+                inner.get(k, jnp.zeros(size)),
+                jnp.reshape(back.get(k, 0.), 1)
+            ]) for front, inner, back in zip(first, interior, last)
+        ]
+        diags.append(jnp.stack(rows, axis=1).ravel())
+
+    return Banded(jnp.stack(diags), offsets)
+
+
+def mask_F(cell: PVCell, F: Array, F_last: Array) -> Array:
+
+    # Rows of a padded cell, with one row of F per unknown of each node: the
+    # back contact conditions F_last move to the last node of the cell, and
+    # the rows of the padding are zero, so that its unknowns never move
+    node = jnp.arange(cell.mask.size)[:, None]
+    last = mesh.last_node(cell)
+    F = F.reshape(cell.mask.size, -1)
+
+    return jnp.where(node == last, F_last,
+                     jnp.where(node > last, 0., F)).ravel()
+
+
+def mask_deriv(cell: PVCell, rows: Tuple[Array, ...],
+               rows_last: Tuple[f64, ...],
+               rows_pad: Tuple[f64, ...]) -> Tuple[Array, ...]:
+
+    # Derivatives of the interior rows of a padded cell: the row of the last
+    # node of the cell takes those of the back contact condition, and the
+    # rows of the padding those of the identity
+    node = jnp.arange(1, cell.mask.size - 1)
+    last = mesh.last_node(cell)
+
+    return tuple(
+        jnp.where(node == last, d_last, jnp.where(node > last, d_pad, d))
+        for d, d_last, d_pad in zip(rows, rows_last, rows_pad))
+
+
+def mask_F_deriv(cell: PVCell, pot: Potentials, dde: tuple, ddp: tuple,
+                 dpois: tuple, dctct_phin: tuple,
+                 dctct_phip: tuple) -> Tuple[tuple, ...]:
+
+    # Derivatives of comp_F for a padded cell, in the order of those of
+    # ddiff, poisson and bcond. The back contact conditions only depend on
+    # the unknowns of the last two nodes of the cell.
+    cell_L, pot_L = mesh.tail(cell, pot)
+    dn = bcond.contact_phin_deriv(cell_L, pot_L)[4:]
+    dp = bcond.contact_phip_deriv(cell_L, pot_L)[4:]
+
+    dde = mask_deriv(cell, dde, (dn[0], dn[1], 0., 0., dn[2], dn[3], 0.),
+                     (0., 1., 0., 0., 0., 0., 0.))
+    ddp = mask_deriv(cell, ddp, (0., dp[0], dp[1], 0., dp[2], dp[3], 0.),
+                     (0., 0., 1., 0., 0., 0., 0.))
+    dpois = mask_deriv(cell, dpois, (0., 1., 0., 0., 0.),
+                       (0., 1., 0., 0., 0.))
+
+    # The rows of the last entry become identity rows once it is padding
+    padded = mesh.last_node(cell) < cell.mask.size - 1
+    identity = (0., 1., 0., 0.)
+    dctct_phin = dctct_phin[:4] + tuple(
+        jnp.where(padded, i, d) for d, i in zip(dctct_phin[4:], identity))
+    dctct_phip = dctct_phip[:4] + tuple(
+        jnp.where(padded, i, d) for d, i in zip(dctct_phip[4:], identity))
+
+    return dde, ddp, dpois, dctct_phin, dctct_phip
+
+
+def stack_F(cell: PVCell, bound: Boundary, pot: Potentials, ddn: Array,
+            ddp: Array, pois: Array, ctct_phin: Tuple[f64, f64],
+            ctct_phip: Tuple[f64, f64]) -> Array:
+
+    # Residual from the equations of the interior nodes and the contact
+    # conditions of the carriers, as computed by comp_F and comp_F_and_J
+    ctct_0_phin, ctct_L_phin = ctct_phin
+    ctct_0_phip, ctct_L_phip = ctct_phip
     ctct_0_phi, ctct_L_phi = bcond.contact_phi(cell, bound, pot)
 
     lenF = 3 + 3 * len(pois) + 3
@@ -29,105 +126,83 @@ def comp_F(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
     result = result.at[-3:].set(jnp.array(
         [ctct_L_phin, ctct_L_phip, ctct_L_phi]))
 
+    if cell.mask is not None:
+        cell_L, pot_L = mesh.tail(cell, pot)
+        result = mask_F(cell, result, jnp.array([
+            bcond.contact_phin(cell_L, bound, pot_L)[1],
+            bcond.contact_phip(cell_L, bound, pot_L)[1],
+            bcond.contact_phi(cell_L, bound, pot_L)[1]
+        ]))
+
     return result
 
 
+def stack_J(cell: PVCell, pot: Potentials, dde: tuple, ddp: tuple,
+            dpois: tuple, dctct_phin: tuple, dctct_phip: tuple) -> Banded:
+
+    # Jacobian from the derivatives of the equations of the interior nodes
+    # and the contact conditions, as computed by comp_F_deriv and
+    # comp_F_and_J
+    if cell.mask is not None:
+        dde, ddp, dpois, dctct_phin, dctct_phip = mask_F_deriv(
+            cell, pot, dde, ddp, dpois, dctct_phin, dctct_phip)
+
+    first = (dict(zip(CTCT_PHIN_OFFSETS[:4], dctct_phin[:4])),
+             dict(zip(CTCT_PHIP_OFFSETS[:4], dctct_phip[:4])), {0: 1.})
+    interior = (dict(zip(DDN_OFFSETS, dde)), dict(zip(DDP_OFFSETS, ddp)),
+                dict(zip(POIS_OFFSETS, dpois)))
+    last = (dict(zip(CTCT_PHIN_OFFSETS[4:], dctct_phin[4:])),
+            dict(zip(CTCT_PHIP_OFFSETS[4:], dctct_phip[4:])), {0: 1.})
+
+    return band(OFFSETS, first, interior, last)
+
+
 @jit
-def comp_F_deriv(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
+def comp_F(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
+
+    return stack_F(cell, bound, pot, ddiff.ddn(cell, pot),
+                   ddiff.ddp(cell, pot), poisson.pois(cell, pot),
+                   bcond.contact_phin(cell, bound, pot),
+                   bcond.contact_phip(cell, bound, pot))
+
+
+@jit
+def comp_F_deriv(cell: PVCell, bound: Boundary,
+                 pot: Potentials) -> Banded:
 
     # TODO: boundaries unused
 
-    dde_phin_, dde_phin__, dde_phin___, dde_phip__,\
-        dde_phi_, dde_phi__, dde_phi___ = ddiff.ddn_deriv(cell, pot)
-    ddp_phin__, ddp_phip_, ddp_phip__, ddp_phip___,\
-        ddp_phi_, ddp_phi__, ddp_phi___ = ddiff.ddp_deriv(cell, pot)
-    dpois_phi_, dpois_phi__, dpois_phi___, dpois_dphin__,\
-        dpois_dphip__ = poisson.pois_deriv(cell, pot)
-
-    dctct_phin = bcond.contact_phin_deriv(cell, pot)
-    dctct_phip = bcond.contact_phip_deriv(cell, pot)
-
-    N = cell.Eg.size
-
-    row = jnp.concatenate([
-        jnp.zeros(4),
-        jnp.ones(4),
-        jnp.array([2]),
-        jnp.tile(3 * (N - 1), 4),
-        jnp.tile(3 * (N - 1) + 1, 4),
-        jnp.array([3 * (N - 1) + 2]),
-        jnp.tile(jnp.arange(3, 3 * (N - 1), 3), 7),
-        jnp.tile(jnp.arange(4, 3 * (N - 1) + 1, 3), 7),
-        jnp.tile(jnp.arange(5, 3 * (N - 1) + 2, 3), 5)
-    ]).astype(jnp.int32)
-
-    col = jnp.concatenate([
-        jnp.array([0, 2, 3, 5]),
-        jnp.array([1, 2, 4, 5]),
-        jnp.array([2]),
-        jnp.array([3 * (N - 2), 3 * (N - 2) + 2,
-                   3 * (N - 1), 3 * (N - 1) + 2
-                   ]),
-        jnp.array([3 * (N - 2) + 1, 3 * (N - 2) + 2,
-                   3 * (N - 1) + 1, 3 * (N - 1) + 2
-                   ]),
-        jnp.array([3 * (N - 1) + 2]),
-        jnp.arange(0, 3 * (N - 2), 3),
-        jnp.arange(3, 3 * (N - 1), 3),
-        jnp.arange(6, 3 * N, 3),
-        jnp.arange(4, 3 * (N - 1) + 1, 3),
-        jnp.arange(2, 3 * (N - 2) + 2, 3),
-        jnp.arange(5, 3 * (N - 1) + 2, 3),
-        jnp.arange(8, 3 * N + 2, 3),
-        jnp.arange(3, 3 * (N - 1), 3),
-        jnp.arange(1, 3 * (N - 2) + 1, 3),
-        jnp.arange(4, 3 * (N - 1) + 1, 3),
-        jnp.arange(7, 3 * N + 1, 3),
-        jnp.arange(2, 3 * (N - 2) + 2, 3),
-        jnp.arange(5, 3 * (N - 1) + 2, 3),
-        jnp.arange(8, 3 * N + 2, 3),
-        jnp.arange(2, 3 * (N - 2) + 2, 3),
-        jnp.arange(5, 3 * (N - 1) + 2, 3),
-        jnp.arange(8, 3 * N + 2, 3),
-        jnp.arange(3, 3 * (N - 1), 3),
-        jnp.arange(4, 3 * (N - 1) + 1, 3)
-    ]).astype(jnp.int32)
-
-    dF = jnp.concatenate([
-        jnp.array([dctct_phin[0], dctct_phin[2],
-                   dctct_phin[1], dctct_phin[3]]),
-        jnp.array([dctct_phip[0], dctct_phip[2],
-                   dctct_phip[1], dctct_phip[3]]),
-        jnp.ones(1),
-        jnp.array([dctct_phin[4], dctct_phin[6],
-                   dctct_phin[5], dctct_phin[7]]),
-        jnp.array([dctct_phip[4], dctct_phip[6],
-                   dctct_phip[5], dctct_phip[7]]),
-        jnp.ones(1),
-        dde_phin_,
-        dde_phin__,
-        dde_phin___,
-        dde_phip__,
-        dde_phi_,
-        dde_phi__,
-        dde_phi___,
-        ddp_phin__,
-        ddp_phip_,
-        ddp_phip__,
-        ddp_phip___,
-        ddp_phi_,
-        ddp_phi__,
-        ddp_phi___,
-        dpois_phi_,
-        dpois_phi__,
-        dpois_phi___,
-        dpois_dphin__,
-        dpois_dphip__,
-    ])
-
-    spF = linalg.coo2sparse(row, col, dF, 3 * N)
-
-    return spF
+    return stack_J(cell, pot, ddiff.ddn_deriv(cell, pot),
+                   ddiff.ddp_deriv(cell, pot), poisson.pois_deriv(cell, pot),
+                   bcond.contact_phin_deriv(cell, pot),
+                   bcond.contact_phip_deriv(cell, pot))
+
+
+@jit
+def comp_F_and_J(cell: PVCell, bound: Boundary,
+                 pot: Potentials) -> Tuple[Array, Banded]:
+
+    # comp_F and comp_F_deriv in one pass, evaluating the exponentials of
+    # the carrier densities and currents once per node and interval and
+    # sharing them between the residual and its derivatives
+    n, p, exppsi_n, expphi_n, expmpsi_p, expmphi_p = physics.carriers(
+        cell, pot)
+    Jn, DJn = current.Jn_and_deriv(cell, pot, exppsi_n, expphi_n)
+    Jp, DJp = current.Jp_and_deriv(cell, pot, expmpsi_p, expmphi_p)
+    R, DR = recomb.all_recomb_and_deriv(cell, n, p)
+
+    ddn, dde = ddiff.ddn_and_deriv(cell, R, DR, Jn, DJn)
+    ddp, dddp = ddiff.ddp_and_deriv(cell, R, DR, Jp, DJp)
+    pois, dpois = poisson.pois_and_deriv(cell, pot, n, p)
+    ctct_phin, dctct_phin = bcond.contact_phin_and_deriv(
+        cell, bound, n, Jn, DJn)
+    ctct_phip, dctct_phip = bcond.contact_phip_and_deriv(
+        cell, bound, p, Jp, DJp)
+
+    F = stack_F(cell, bound, pot, ddn, ddp, pois, ctct_phin, ctct_phip)
+    spJ = stack_J(cell, pot, dde, dddp, dpois, dctct_phin, dctct_phip)
+
+    return F, spJ
 
 
 @jit
@@ -139,37 +214,24 @@ def comp_F_eq(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
         [jnp.array([ctct_0_phi]), pois,
          jnp.array([ctct_L_phi])])
 
+    if cell.mask is not None:
+        cell_L, pot_L = mesh.tail(cell, pot)
+        resid = mask_F(cell, resid,
+                       bcond.contact_phi(cell_L, bound, pot_L)[1])
+
     return resid
 
 
 @jit
-def comp_F_eq_deriv(cell: PVCell, bound: Boundary, pot: Potentials) -> Array:
+def comp_F_eq_deriv(cell: PVCell, bound: Boundary,
+                    pot: Potentials) -> Banded:
 
     # TODO: boundaries unused
 
-    N = cell.Eg.size
-    dpois_phi_, dpois_phi__, dpois_phi___ = poisson.pois_deriv_eq(cell, pot)
-
-    row = jnp.concatenate([
-        jnp.array([0]),
-        jnp.arange(1, N - 1),
-        jnp.arange(1, N - 1),
-        jnp.arange(1, N - 1),
-        jnp.array([N - 1])
-    ]).astype(jnp.int32)
-
-    col = jnp.concatenate([
-        jnp.array([0]),
-        jnp.arange(0, N - 2),
-        jnp.arange(1, N - 1),
-        jnp.arange(2, N),
-        jnp.array([N - 1])
-    ]).astype(jnp.int32)
-
-    dFeq = jnp.concatenate(
-        [jnp.array([1]), dpois_phi_, dpois_phi__, dpois_phi___,
-         jnp.array([1])])
+    dpois = poisson.pois_deriv_eq(cell, pot)
 
-    spFeq = linalg.coo2sparse(row, col, dFeq, N)
+    if cell.mask is not None:
+        dpois = mask_deriv(cell, dpois, (0., 1., 0.), (0., 1., 0.))
 
-    return spFeq
+    return band(OFFSETS_EQ, ({0: 1.}, ), (dict(zip(OFFSETS_EQ, dpois)), ),
+                ({0: 1.}, ))
@@ -1,7 +1,11 @@
-from deltapv import (objects, scales, optical, sun, solver,
-                     bcond, spline, util, adjoint)
-from jax import numpy as jnp, vmap
+from deltapv import (objects, scales, optical, sun, solver, residual,
+                     linalg, bcond, current, spline, mesh, util, adjoint)
+from deltapv import dataclasses_dpv as dataclasses
+from jax import (numpy as jnp, jit, jvp, vmap, lax, tree_util, grad,
+                 value_and_grad, custom_jvp, custom_vjp)
+from functools import partial
 from typing import Callable, Tuple, List, Union
+import numpy as np
 
 import logging
 logger = logging.getLogger("deltapv")
@@ -11,10 +15,12 @@ PVDesign = objects.PVDesign
 Material = objects.Material
 LightSource = objects.LightSource
 Potentials = objects.Potentials
+SolverOptions = objects.SolverOptions
 Array = util.Array
 f64 = util.f64
 i64 = util.i64
 DIM_V_INIT = 0.01
+DIM_V_TOL = 1e-6
 
 
 def empty_design(dim_grid: Array) -> PVDesign:
@@ -132,11 +138,13 @@ def make_design(n_points: i64,
                 Spr: f64,
                 grid: Array = None,
                 PhiM0: f64 = -1,
-                PhiML: f64 = -1):
+                PhiML: f64 = -1,
+                graded: bool = False):
     """Convenience function for defining a complete design.
 
     Args:
-        n_points (i64): Number of points on a uniform grid
+        n_points (i64): Number of points on a uniform grid, or on a graded
+            grid if graded is True
         Ls (List[f64]): Thicknesses of each layer
         mats (Union[List[Material], Material]): List of materials
         Ns (List[f64]): List of doping densities
@@ -146,6 +154,9 @@ def make_design(n_points: i64,
         Spr (f64): Hole recombination velocity at back contact
         PhiM0 (f64, optional): Workfunction of front contact. Defaults to -1.
         PhiML (f64, optional): Workfunction of back contact. Defaults to -1.
+        graded (bool, optional): Whether to concentrate the grid points at
+            the interfaces and contacts, see mesh.graded_grid. Ignored if a
+            grid is given. Defaults to False.
 
     Returns:
         PVDesign: Complete cell design defined by parameters
@@ -153,7 +164,9 @@ def make_design(n_points: i64,
     if isinstance(mats, Material):
         mats = [mats] * len(Ls)
     L = sum(Ls)
-    if grid is None:
+    if grid is None and graded:
+        grid = mesh.graded_grid(n_points, Ls, mats, Ns)
+    elif grid is None:
         grid = jnp.linspace(0, L, n_points)
     des = empty_design(grid)
     start = 0
@@ -204,7 +217,8 @@ def incident_light(kind: str = "sun",
 
 def init_cell(design: PVDesign,
               ls: LightSource,
-              optics: bool = True) -> PVCell:
+              optics: bool = True,
+              bucket: bool = False) -> PVCell:
     """Initialize a cell by calculating generation density with optical model
 
     Args:
@@ -214,11 +228,32 @@ def init_cell(design: PVDesign,
             the absorption coefficients. If False, model uses input absorption
             coefficients as specified in the PVDesign object to calculate
             generation density. Defaults to True.
+        bucket (bool, optional): Whether to pad the cell to the next bucket
+            size, see make_cell. Defaults to False.
 
     Returns:
         PVCell: An initialized cell ready for simulation
     """
     G = optical.compute_G(design, ls, optics=optics)
+
+    return make_cell(design, G, bucket)
+
+
+def make_cell(design: PVDesign, G: Array, bucket: bool = False) -> PVCell:
+    """Initialize a cell with a given generation density
+
+    Args:
+        design (PVDesign): A cell
+        G (Array): Generation density, in dimensionless form
+        bucket (bool, optional): Whether to pad the cell to the next bucket
+            size (see mesh.bucket) with inert nodes, marked by the mask of
+            the cell. Solutions on the nodes of the design are unchanged,
+            and all grids of a bucket share the same compiled kernels.
+            Defaults to False.
+
+    Returns:
+        PVCell: An initialized cell ready for simulation
+    """
     dgrid = jnp.diff(design.grid)
     params = design.__dict__.copy()
     params["dgrid"] = dgrid
@@ -226,104 +261,367 @@ def init_cell(design: PVDesign,
     params.pop("A")
     params.pop("alpha")
     params["G"] = G
+    cell = PVCell(**params)
+
+    if bucket:
+        cell = mesh.pad(cell, mesh.bucket(design.grid.size))
 
-    return PVCell(**params)
+    return cell
 
 
-def equilibrium(design: PVDesign, ls: LightSource) -> Potentials:
+def equilibrium(design: PVDesign,
+                ls: LightSource,
+                opts: SolverOptions = SolverOptions()) -> Potentials:
     """Solve equilibrium system for a cell
 
     Args:
         design (PVDesign): A cell
-        ls (LightSource): A light source
+        ls (LightSource): A light source. Unused, as the equilibrium system
+            does not depend on the generation density
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
 
     Returns:
         Potentials: Equilibrium potential and quasi-Fermi energies
     """
-    cell = init_cell(design, ls)
+    cell = make_cell(design, jnp.zeros_like(design.Eg), opts.bucket)
     logger.info("Solving equilibrium...")
     bound_eq = bcond.boundary_eq(cell)
-    pot_ini = solver.eq_guess(cell, bound_eq)
-    pot = solver.solve_eq(cell, bound_eq, pot_ini)
+    pot_ini = solver.eq_guess_seq(cell, opts)
+    pot = solver.solve_eq(cell, bound_eq, pot_ini, opts)
 
-    return pot
+    return mesh.unpad(pot, design.grid.size)
 
 
-def simulate(design: PVDesign,
-             ls: LightSource = incident_light(),
-             optics: bool = True,
-             n_steps: i64 = None,
-             verbose: bool = True) -> dict:
-    """Solve equilibrium and out-of-equilibrium systems for a cell.
+def refine_design(design: PVDesign,
+                  ls: LightSource = incident_light(),
+                  optics: bool = True,
+                  passes: i64 = 3,
+                  tol: f64 = mesh.TOL_JUMP,
+                  opts: SolverOptions = SolverOptions()
+                  ) -> Tuple[PVDesign, Potentials]:
+    """Refine the grid of a design where the equilibrium and short circuit
+    solutions are underresolved, see mesh.refine
+
+    Each pass bisects the intervals across which a solution changes too
+    much and solves again on the refined grid, starting from the
+    interpolated solutions. Refinement stops early once no interval needs
+    it. Not differentiable, as the grid depends on the solutions.
 
     Args:
         design (PVDesign): A cell
-        ls (LightSource): A light source
-        optics (bool, optional): Whether to use optical model to calculate
-            the absorption coefficients. If False, model uses ijnput absorption
-            coefficients as specified in the PVDesign object to calculate
-            generation density. Defaults to True.
-        n_steps (i64, optional): How many voltage steps to solve for. May be
-            useful when an IV curve of a specific range is needed, but
-            unnecessary in other cases. Defaults to None.
+        ls (LightSource, optional): A light source. Defaults to
+            incident_light().
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        passes (i64, optional): Largest number of refinement passes.
+            Defaults to 3.
+        tol (f64, optional): Largest change of the potentials across an
+            interval in units of kT. Defaults to mesh.TOL_JUMP.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
 
     Returns:
-        dict: Dictionary of results: "cell" is the initialized cell, "eq" is
-            the equilibrium solution, "Voc" is the final solution beyond the
-            open circuit voltage, "mpp" is the maximum power found in W, "eff"
-            is the power conversion efficiency, "iv" is a tuple (v, i) of
-            the IV curve
+        Tuple[PVDesign, Potentials]: Refined design and its equilibrium
+            solution
     """
-    if not verbose:
-        temp = logger.level
-        logger.setLevel("WARNING")
+    # Cells are padded if opts.bucket is set, while the solutions refined
+    # by mesh.refine are on the grid of the design
+    n = design.grid.size
+    pot_eq = equilibrium(design, ls, opts)
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    guess = solver.ooe_guess_seq(cell, mesh.pad_pot(pot_eq, cell.Eg.size),
+                                 opts)
+    _, pot_sc = adjoint.solve_pdd(cell, 0., guess, opts)
+    pot_sc = mesh.unpad(pot_sc, n)
+
+    for _ in range(passes):
+        refined, (pot_eq, pot_sc) = mesh.refine(design, [pot_eq, pot_sc],
+                                                tol)
+        if refined is design:
+            break
+        design = refined
+        n = design.grid.size
+        logger.info(f"Refined grid to {n} points...")
+
+        cell = make_cell(design, jnp.zeros_like(design.Eg), opts.bucket)
+        bound_eq = bcond.boundary_eq(cell)
+        pot_eq = solver.solve_eq(cell, bound_eq,
+                                 mesh.pad_pot(pot_eq, cell.Eg.size), opts)
+        pot_eq = mesh.unpad(pot_eq, n)
+        cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+        _, pot_sc = adjoint.solve_pdd(cell, 0.,
+                                      mesh.pad_pot(pot_sc, cell.Eg.size),
+                                      opts)
+        pot_sc = mesh.unpad(pot_sc, n)
+
+    return design, pot_eq
+
+
+@partial(jit, static_argnums=(2, 3))
+def sweep(cell: PVCell,
+          pot_eq: Potentials,
+          n_steps: i64 = None,
+          adaptive: bool = False,
+          opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve the out-of-equilibrium system over an IV sweep in a single
+    compiled loop
+
+    Result buffers are allocated for the maximum number of steps up front,
+    and the sweep stops on device once the current changes sign or becomes
+    negative. All outputs have fixed shapes, so the sweep can be used under
+    jit and vmap.
 
-    pot_eq = equilibrium(design, ls)
+    Args:
+        cell (PVCell): An initialized cell
+        pot_eq (Potentials): Equilibrium solution
+        n_steps (i64, optional): How many voltage steps to solve for. If
+            None, at most 100 steps are solved, stopping beyond the open
+            circuit voltage. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration. The
+            Newton loops are always compiled. Defaults to SolverOptions().
 
-    cell = init_cell(design, ls, optics=optics)
+    Returns:
+        dict: Dictionary of results: "n" is the number of voltage steps
+            solved, "iv" is a tuple (v, i) of the IV curve in V and A/cm^2,
+            "pots" are the solutions stacked along the first axis,
+            "converged" flags the steps whose Newton iteration converged,
+            "mpp" is the maximum power found in W and "vmax" its voltage.
+            Currents and solutions past the first "n" steps are zero.
+    """
+    opts = dataclasses.replace(opts, compiled=True)
+    n_max = 100 if n_steps is None else n_steps
+    dv = solver.vincr(cell)
+    dv_min, dv_max = solver.vincr(cell, 100), solver.vincr(cell, 5)
+    if adaptive:
+        voltages = jnp.zeros(n_max)
+    else:
+        voltages = dv * jnp.arange(n_max)
+
+    # Just use a rough guess from equilibrium for the first step, and solve
+    # for a voltage close to zero for the linear guess of the second
+    guess = solver.ooe_guess_seq(cell, pot_eq, opts)
+    total_j, pot, aux = adjoint.solve_pdd_reuse(cell, voltages[0], guess,
+                                                None, opts)
+    error = aux["error"]
+    vinit = DIM_V_INIT / scales.energy
+    _, potinit, aux = adjoint.solve_pdd_reuse(cell, vinit, pot, aux, opts)
+
+    currents = jnp.zeros(n_max).at[0].set(total_j)
+    errors = jnp.full(n_max, jnp.nan).at[0].set(error)
+    pots = tree_util.tree_map(
+        lambda x: jnp.zeros((n_max, ) + x.shape).at[0].set(x), pot)
+
+    def cond_fun(state):
+        vstep, done = state[0], state[-1]
+        return jnp.logical_and(vstep < n_max, jnp.logical_not(done))
+
+    def body_fun(state):
+        (vstep, dv, voltages, pot, potl, potll, aux, currents, errors, pots,
+         _) = state
+
+        # Linear guess from the near-zero solve on the second step, from the
+        # last two steps on the third, and quadratic guess from the last
+        # three steps after that
+        if adaptive:
+            vl, vll, vlll = voltages[jnp.maximum(vstep - jnp.arange(1, 4),
+                                                 0)]
+            v = vl + dv
+            guesses = (solver.genlinguess(potinit, pot, vinit, v - vinit),
+                       solver.genlinguess(pot, potl, vl - vll, v - vl),
+                       solver.genquadguess(pot, potl, potll, vl - vll,
+                                           vll - vlll, v - vl))
+        else:
+            v = voltages[vstep]
+            guesses = (solver.genlinguess(potinit, pot, vinit, dv - vinit),
+                       solver.linguess(pot, potl),
+                       solver.quadguess(pot, potl, potll))
+        guess = tree_util.tree_map(
+            lambda g1, g2, g3: jnp.where(vstep == 1, g1,
+                                         jnp.where(vstep == 2, g2, g3)),
+            *guesses)
+        total_j, new, aux = adjoint.solve_pdd_reuse(cell, v, guess, aux, opts)
+
+        voltages_new = voltages.at[vstep].set(v)
+        currents_new = currents.at[vstep].set(total_j)
+        errors_new = errors.at[vstep].set(aux["error"])
+        pots_new = tree_util.tree_map(lambda xs, x: xs.at[vstep].set(x),
+                                      pots, new)
+
+        if n_steps is None:
+            ll = currents[vstep - 1]
+            done = jnp.logical_and(
+                vstep >= 2,
+                jnp.logical_or(ll * total_j <= 0, total_j < 0))
+        else:
+            done = jnp.array(False)
+
+        if not adaptive:
+            return (vstep + 1, dv, voltages_new, new, pot, potl, aux,
+                    currents_new, errors_new, pots_new, done)
+
+        idx = jnp.maximum(vstep + jnp.arange(-2, 1), 0)
+        dv_new = solver.vadapt(dv, aux["niter"], solver.n_target[opts.newton],
+                               voltages_new[idx], currents_new[idx],
+                               currents_new[0], dv_min, dv_max)
+        accepted = (vstep + 1, dv_new, voltages_new, new, pot, potl, aux,
+                    currents_new, errors_new, pots_new, done)
+
+        # Retry with a smaller step if the curvature at the new point calls
+        # for one, or to resolve the open circuit voltage, see simulate
+        dv_retry = jnp.maximum(
+            jnp.where(total_j < 0, jnp.minimum(dv_new, dv / 4), dv_new),
+            dv_min)
+        rejected = (vstep, dv_retry, voltages, pot, potl, potll, aux,
+                    currents, errors, pots, jnp.array(False))
+        reject = jnp.logical_and(
+            jnp.logical_and(vstep >= 2, dv > dv_min),
+            jnp.logical_or(dv_new < dv / 2, total_j < 0))
+
+        return tree_util.tree_map(lambda r, a: jnp.where(reject, r, a),
+                                  rejected, accepted)
+
+    state_ini = (i64(1), f64(dv), voltages, pot, pot, pot, aux, currents,
+                 errors, pots, jnp.array(False))
+    n, _, voltages, *_, currents, errors, pots, _ = lax.while_loop(
+        cond_fun, body_fun, state_ini)
+
+    if adaptive:
+        # Continue the voltages past the last step, so that the padded spline
+        # intervals stay well defined
+        k = jnp.arange(n_max)
+        voltages = jnp.where(k < n, voltages,
+                             voltages[n - 1] + dv_min * (k - n + 1))
+
+    dim_currents = scales.current * currents
+    dim_voltages = scales.energy * voltages
+
+    pmax, vmax = spline.calcPmax(dim_voltages,
+                                 dim_currents * 1e4,
+                                 n)  # A/cm^2 -> A/m2
+
+    results = {
+        "n": n,
+        "iv": (dim_voltages, dim_currents),
+        "pots": pots,
+        "converged": errors <= solver.tol_newton,
+        "mpp": pmax,
+        "vmax": vmax
+    }
+
+    return results
+
+
+def sweep_loop(cell: PVCell,
+               pot_eq: Potentials,
+               n_steps: i64 = None,
+               adaptive: bool = False,
+               opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve the out-of-equilibrium system over an IV sweep one voltage after
+    another, with the next guess extrapolated from the last solutions
+
+    Args:
+        cell (PVCell): An initialized cell
+        pot_eq (Potentials): Equilibrium solution
+        n_steps (i64, optional): How many voltage steps to solve for, see
+            simulate. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of results, see sweep, with all arrays holding the
+            "n" steps solved only
+    """
     currents = jnp.array([], dtype=f64)
     voltages = jnp.array([], dtype=f64)
     dv = solver.vincr(cell)
+    dv_min, dv_max = solver.vincr(cell, 100), solver.vincr(cell, 5)
     pots = []
+    errors = []
     vstep = 0
+    aux = None
 
     while vstep < 100:
 
-        v = dv * vstep
+        if adaptive and vstep > 0:
+            v = voltages[-1] + dv
+        else:
+            v = dv * vstep
         scaled_v = v * scales.energy
         logger.info("Solving for {:.2f} V (Step {:3d})...".format(
             scaled_v, vstep))
 
         if vstep == 0:
             # Just use a rough guess from equilibrium
-            guess = solver.ooe_guess(cell, pot_eq)
-            total_j, pot = adjoint.solve_pdd(cell, v, guess)
+            guess = solver.ooe_guess_seq(cell, pot_eq, opts)
+            total_j, pot, aux = adjoint.solve_pdd_reuse(
+                cell, v, guess, aux, opts)
         elif vstep == 1:
             # Solve for a voltage close to zero for linear guess
             potl = pot
-            logger.info(
-                "Solving for {:.2f} V for convergence...".format(DIM_V_INIT))
+            logger.info("Solving for {:.2f} V for convergence...".format(
+                DIM_V_INIT))
             vinit = DIM_V_INIT / scales.energy
-            _, potinit = adjoint.solve_pdd(cell, vinit, pot)
+            _, potinit, aux = adjoint.solve_pdd_reuse(
+                cell, vinit, pot, aux, opts)
             # Generate linear guess
             logger.info(f"Continuing...")
-            guess = solver.genlinguess(potinit, pot, vinit, dv - vinit)
-            total_j, pot = adjoint.solve_pdd(cell, v, guess)
+            guess = solver.genlinguess(potinit, pot, vinit, v - vinit)
+            total_j, pot, aux = adjoint.solve_pdd_reuse(
+                cell, v, guess, aux, opts)
         elif vstep == 2:
             # Generate linear guess from first two steps
-            potll = potl
-            guess = solver.linguess(pot, potl)
-            total_j, new = adjoint.solve_pdd(cell, v, guess)
-            potl, pot = pot, new
+            if adaptive:
+                guess = solver.genlinguess(pot, potl,
+                                           voltages[-1] - voltages[-2],
+                                           v - voltages[-1])
+            else:
+                guess = solver.linguess(pot, potl)
+            total_j, new, aux = adjoint.solve_pdd_reuse(
+                cell, v, guess, aux, opts)
         else:
             # Generate quadratic guess from last three steps
-            guess = solver.quadguess(pot, potl, potll)
-            total_j, new = adjoint.solve_pdd(cell, v, guess)
+            if adaptive:
+                guess = solver.genquadguess(pot, potl, potll,
+                                            voltages[-1] - voltages[-2],
+                                            voltages[-2] - voltages[-3],
+                                            v - voltages[-1])
+            else:
+                guess = solver.quadguess(pot, potl, potll)
+            total_j, new, aux = adjoint.solve_pdd_reuse(
+                cell, v, guess, aux, opts)
+
+        if adaptive and vstep >= 1:
+            # Next step from the last three points including the new one.
+            # The new point is rejected if the curvature there calls for
+            # a much smaller step, or if it lies past the open circuit
+            # voltage, which is then resolved to within the smallest step
+            idx = jnp.maximum(jnp.arange(vstep - 2, vstep + 1), 0)
+            dv_next = solver.vadapt(dv, aux["niter"],
+                                    solver.n_target[opts.newton],
+                                    jnp.append(voltages, v)[idx],
+                                    jnp.append(currents, total_j)[idx],
+                                    currents[0], dv_min, dv_max)
+            if vstep >= 2 and dv > dv_min and (dv_next < dv / 2
+                                               or total_j < 0):
+                logger.info("Step too large, refining...")
+                dv = jnp.maximum(
+                    jnp.where(total_j < 0, jnp.minimum(dv_next, dv / 4),
+                              dv_next), dv_min)
+                continue
+            dv = dv_next
+
+        if vstep >= 2:
             potll, potl, pot = potl, pot, new
 
         pots.append(pot)
+        errors.append(aux["error"])
         currents = jnp.append(currents, total_j)
-        voltages = jnp.append(voltages, dv * vstep)
+        voltages = jnp.append(voltages, v)
         vstep += 1
 
         if n_steps is not None:
@@ -341,6 +639,327 @@ def simulate(design: PVDesign,
     pmax, vmax = spline.calcPmax(dim_voltages,
                                  dim_currents * 1e4)  # A/cm^2 -> A/m2
 
+    results = {
+        "n": vstep,
+        "iv": (dim_voltages, dim_currents),
+        "pots": tree_util.tree_map(lambda *xs: jnp.stack(xs), *pots),
+        "converged": jnp.array(errors) <= solver.tol_newton,
+        "mpp": pmax,
+        "vmax": vmax
+    }
+
+    return results
+
+
+@jit
+def solve_batch(cell: PVCell,
+                voltages: Array,
+                guesses: Potentials,
+                opts: SolverOptions = SolverOptions()) -> tuple:
+    """Solve the out-of-equilibrium system at many voltages at once
+
+    Args:
+        cell (PVCell): An initialized cell
+        voltages (Array): Voltages to solve at, in dimensionless form
+        guesses (Potentials): Initial guesses, stacked along the first axis
+        opts (SolverOptions, optional): Newton solver configuration. The
+            Newton loops are always compiled. Defaults to SolverOptions().
+
+    Returns:
+        (Array, Potentials, Array): Tuple of currents, in dimensionless form,
+        solutions stacked along the first axis, and flags of the voltages
+        whose Newton iteration converged
+    """
+    opts = dataclasses.replace(opts, compiled=True)
+
+    def solve_one(v, guess):
+        total_j, pot, aux = adjoint.solve_pdd_reuse(cell, v, guess, None,
+                                                    opts)
+        return total_j, pot, aux["error"] <= solver.tol_newton
+
+    return vmap(solve_one)(voltages, guesses)
+
+
+def interpguess(va: Array, pa: Potentials, v: f64) -> Potentials:
+
+    # Quadratic interpolation of the anchor solutions pa at voltages va,
+    # through the first anchor at or above v and the two below it, or
+    # linear interpolation if there are only two anchors
+    if va.size == 1:
+        return tree_util.tree_map(lambda x: x[0], pa)
+
+    i = jnp.clip(jnp.searchsorted(va, v), min(2, va.size - 1), va.size - 1)
+    pot, potl, potll = (tree_util.tree_map(lambda x: x[k], pa)
+                        for k in (i, i - 1, jnp.maximum(i - 2, 0)))
+    if va.size == 2:
+        return solver.genlinguess(pot, potl, va[i] - va[i - 1], v - va[i])
+
+    return solver.genquadguess(pot, potl, potll, va[i] - va[i - 1],
+                               va[i - 1] - va[i - 2], v - va[i])
+
+
+def stackpad(pa: Potentials, size: i64) -> Potentials:
+
+    # Solutions stacked along the first axis, padded with their last node
+    # or cut to size nodes
+    n = pa.phi.shape[-1]
+    if n >= size:
+        return mesh.unpad(pa, size)
+
+    return tree_util.tree_map(
+        lambda x: jnp.pad(x, ((0, 0), (0, size - n)), mode="edge"), pa)
+
+
+def sweep_parallel(cell: PVCell,
+                   pot_eq: Potentials,
+                   n_steps: i64 = None,
+                   stride: i64 = 4,
+                   anchors: tuple = None,
+                   opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve the out-of-equilibrium system at all voltages of an IV sweep at
+    once
+
+    Guesses for all voltages are interpolated from a few anchor solutions,
+    either a coarse sequential sweep taking every stride-th voltage, or a
+    previous curve. All voltages are then solved together with solve_batch,
+    and only those that did not converge are solved again one after
+    another, starting from a linear guess through the two converged
+    solutions nearest in voltage. Voltages still unconverged after that are
+    logged and flagged in "converged". If the current has not changed sign
+    by the last anchor, the sweep continues one voltage after another
+    until it does.
+
+    Args:
+        cell (PVCell): An initialized cell
+        pot_eq (Potentials): Equilibrium solution
+        n_steps (i64, optional): How many voltage steps to solve for. If
+            None, the sweep stops beyond the open circuit voltage, as in
+            simulate. Defaults to None.
+        stride (i64, optional): Number of voltage steps between coarse
+            anchors. Defaults to 4.
+        anchors (tuple, optional): Tuple (v, pots) of voltages in V and
+            solutions of a previous curve, e.g. of a similar design on a
+            grid of as many points, used instead of the coarse sweep. pots
+            is either a list of solutions, as in the "pots" of the results
+            of simulate, or solutions stacked along the first axis, padded
+            or not. Defaults to None.
+        opts (SolverOptions, optional): Newton solver configuration, used
+            for the coarse sweep and the repeated solves. Defaults to
+            SolverOptions().
+
+    Returns:
+        dict: Dictionary of results, see sweep, with all arrays holding the
+            "n" steps solved only
+    """
+    dv = solver.vincr(cell)
+    n_max = 100 if n_steps is None else n_steps
+
+    if anchors is None:
+        logger.info("Solving coarse sweep for guesses...")
+        va = [0.]
+        guess = solver.ooe_guess_seq(cell, pot_eq, opts)
+        total_j, pot, aux = adjoint.solve_pdd_reuse(cell, 0., guess, None,
+                                                    opts)
+        vinit = DIM_V_INIT / scales.energy
+        _, potinit, aux = adjoint.solve_pdd_reuse(cell, vinit, pot, aux,
+                                                  opts)
+        pa = [pot]
+        while stride * (len(va) - 1) < n_max - 1:
+            v = min(stride * len(va), n_max - 1) * dv
+            if len(va) == 1:
+                guess = solver.genlinguess(potinit, pot, vinit, v - vinit)
+            elif len(va) == 2:
+                guess = solver.genlinguess(pa[-1], pa[-2], va[-1] - va[-2],
+                                           v - va[-1])
+            else:
+                guess = solver.genquadguess(pa[-1], pa[-2], pa[-3],
+                                            va[-1] - va[-2], va[-2] - va[-3],
+                                            v - va[-1])
+            total_j, pot, aux = adjoint.solve_pdd_reuse(
+                cell, v, guess, aux, opts)
+            va.append(v)
+            pa.append(pot)
+            if n_steps is None and total_j < 0:
+                break
+        va = jnp.array(va)
+        pa = tree_util.tree_map(lambda *xs: jnp.stack(xs), *pa)
+    else:
+        va = jnp.asarray(anchors[0]) / scales.energy
+        pa = anchors[1]
+        if isinstance(pa, (list, tuple)):
+            pa = tree_util.tree_map(lambda *xs: jnp.stack(xs), *pa)
+        pa = stackpad(pa, cell.Eg.size)
+
+    # All voltages up to the last anchor, which is past the open circuit
+    # voltage when the coarse sweep found it
+    n_all = min(n_max, int(jnp.round(va[-1] / dv)) + 1)
+    voltages = dv * jnp.arange(n_all)
+    guesses = vmap(interpguess, (None, None, 0))(va, pa, voltages)
+
+    logger.info(f"Solving {n_all} voltages at once...")
+    currents, pots, converged = solve_batch(cell, voltages, guesses, opts)
+
+    for k in range(n_all):
+        if converged[k]:
+            continue
+        logger.info("Solving again for {:.2f} V (Step {:3d})...".format(
+            voltages[k] * scales.energy, k))
+        # Linear guess through the two converged solutions nearest in
+        # voltage, on either side, including those solved again before
+        done = np.flatnonzero(np.asarray(converged))
+        near = done[np.argsort(np.abs(done - k), kind="stable")[:2]]
+        if near.size == 0:
+            guess = solver.ooe_guess_seq(cell, pot_eq, opts)
+        elif near.size == 1:
+            guess = tree_util.tree_map(lambda x: x[near[0]], pots)
+        else:
+            pot, potl = (tree_util.tree_map(lambda x: x[i], pots)
+                         for i in near)
+            guess = solver.genlinguess(pot, potl,
+                                       voltages[near[0]] - voltages[near[1]],
+                                       voltages[k] - voltages[near[0]])
+        total_j, pot, aux = adjoint.solve_pdd_reuse(cell, voltages[k],
+                                                    guess, None, opts)
+        currents = currents.at[k].set(total_j)
+        pots = tree_util.tree_map(lambda xs, x: xs.at[k].set(x), pots, pot)
+        converged = converged.at[k].set(aux["error"] <= solver.tol_newton)
+        if not converged[k]:
+            logger.error("    Step {:3d} at {:.2f} V did not converge!".format(
+                k, voltages[k] * scales.energy))
+
+    # Past the open circuit voltage of the anchors only, continue from
+    # quadratic guesses through the last three solutions
+    aux = None
+    while (n_steps is None and n_all < n_max and n_all >= 3
+           and not jnp.any(currents < 0)):
+        logger.info("Solving beyond the anchors for {:.2f} V (Step {:3d})"
+                    "...".format(n_all * dv * scales.energy, n_all))
+        pot, potl, potll = (tree_util.tree_map(lambda x: x[k], pots)
+                            for k in (-1, -2, -3))
+        guess = solver.genquadguess(pot, potl, potll, dv, dv, dv)
+        total_j, pot, aux = adjoint.solve_pdd_reuse(cell, n_all * dv, guess,
+                                                    aux, opts)
+        voltages = jnp.append(voltages, n_all * dv)
+        currents = jnp.append(currents, total_j)
+        pots = tree_util.tree_map(lambda xs, x: jnp.concatenate([xs, x[None]]),
+                                  pots, pot)
+        converged = jnp.append(converged, aux["error"] <= solver.tol_newton)
+        n_all += 1
+
+    n = n_all
+    if n_steps is None:
+        for k in range(2, n_all):
+            if currents[k - 1] * currents[k] <= 0 or currents[k] < 0:
+                n = k + 1
+                break
+
+    dim_currents = scales.current * currents[:n]
+    dim_voltages = scales.energy * voltages[:n]
+
+    pmax, vmax = spline.calcPmax(dim_voltages,
+                                 dim_currents * 1e4)  # A/cm^2 -> A/m2
+
+    results = {
+        "n": n,
+        "iv": (dim_voltages, dim_currents),
+        "pots": tree_util.tree_map(lambda x: x[:n], pots),
+        "converged": converged[:n],
+        "mpp": pmax,
+        "vmax": vmax
+    }
+
+    return results
+
+
+def simulate(design: PVDesign,
+             ls: LightSource = incident_light(),
+             optics: bool = True,
+             n_steps: i64 = None,
+             adaptive: bool = False,
+             parallel: bool = False,
+             checkpoint: bool = False,
+             refine: i64 = 0,
+             anchors: tuple = None,
+             verbose: bool = True,
+             opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve equilibrium and out-of-equilibrium systems for a cell.
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource): A light source
+        optics (bool, optional): Whether to use optical model to calculate
+            the absorption coefficients. If False, model uses ijnput absorption
+            coefficients as specified in the PVDesign object to calculate
+            generation density. Defaults to True.
+        n_steps (i64, optional): How many voltage steps to solve for. May be
+            useful when an IV curve of a specific range is needed, but
+            unnecessary in other cases. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step to the
+            Newton iteration counts and the curvature of the IV curve, taking
+            large steps where it is flat and small ones around the maximum
+            power point and the open circuit voltage. Defaults to False.
+        parallel (bool, optional): Whether to solve all voltages at once
+            from guesses interpolated between a few coarse steps, see
+            sweep_parallel. Ignores adaptive. Defaults to False.
+        checkpoint (bool, optional): Whether to differentiate the IV curve
+            and solutions implicitly at each voltage, keeping only the
+            converged solutions for reverse mode, see sweep_iv. Reverse mode
+            memory then no longer grows with the Newton iterations, but
+            forward mode is not supported. Defaults to False.
+        refine (i64, optional): Number of passes of grid refinement before
+            the sweep, see refine_design. The refined grid is that of the
+            returned cell. Not differentiable. Defaults to 0.
+        anchors (tuple, optional): Tuple (v, pots) of a previous curve to
+            interpolate guesses from, e.g. (results["iv"][0],
+            results["pots"]) of a similar design on a grid of as many
+            points, see sweep_parallel. Implies parallel. Defaults to None.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration, e.g.
+            SolverOptions(compiled=True) to run the whole sweep on device,
+            or SolverOptions(newton="chord") to keep Jacobians and their
+            factorizations across iterations and voltage steps. Defaults to
+            SolverOptions().
+
+    Returns:
+        dict: Dictionary of results: "cell" is the initialized cell, padded
+            if opts.bucket is set, "eq" is the equilibrium solution, "Voc"
+            is the final solution beyond the open circuit voltage, "mpp" is
+            the maximum power found in W, "eff" is the power conversion
+            efficiency, "iv" is a tuple (v, i) of the IV curve
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    if refine:
+        design, pot_eq = refine_design(design,
+                                       ls,
+                                       optics,
+                                       refine,
+                                       opts=opts)
+    else:
+        pot_eq = equilibrium(design, ls, opts)
+
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    pot_ini = mesh.pad_pot(pot_eq, cell.Eg.size)
+
+    if checkpoint:
+        swept = sweep_iv(cell, pot_ini, n_steps, adaptive, parallel, opts,
+                         anchors)
+        dim_voltages, dim_currents = swept["iv"]
+        pmax, vmax = spline.calcPmax(dim_voltages,
+                                     dim_currents * 1e4)  # A/cm^2 -> A/m2
+    else:
+        swept = run_sweep(cell, pot_ini, n_steps, adaptive, parallel,
+                          anchors, opts)
+        dim_voltages, dim_currents = swept["iv"]
+        pmax, vmax = swept["mpp"], swept["vmax"]
+
+    pots = [
+        tree_util.tree_map(lambda x: x[i, :design.grid.size], swept["pots"])
+        for i in range(dim_voltages.size)
+    ]
+
     eff = pmax / jnp.sum(ls.P_in)
     eff_print = jnp.round(eff * 100, 2)
 
@@ -362,18 +981,308 @@ def simulate(design: PVDesign,
     return results
 
 
+def run_sweep(cell: PVCell,
+              pot_eq: Potentials,
+              n_steps: i64 = None,
+              adaptive: bool = False,
+              parallel: bool = False,
+              anchors: tuple = None,
+              opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve the IV sweep of a cell in the mode chosen, see simulate
+
+    Args:
+        cell (PVCell): An initialized cell
+        pot_eq (Potentials): Equilibrium solution
+        n_steps (i64, optional): How many voltage steps to solve for.
+            Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step.
+            Defaults to False.
+        parallel (bool, optional): Whether to solve all voltages at once.
+            Defaults to False.
+        anchors (tuple, optional): Previous curve to interpolate guesses
+            from, see sweep_parallel. Implies parallel. Defaults to None.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of results, see sweep, with all arrays holding the
+            "n" steps solved only
+    """
+    if parallel or anchors is not None:
+        return sweep_parallel(cell, pot_eq, n_steps, anchors=anchors,
+                              opts=opts)
+
+    if not opts.compiled:
+        return sweep_loop(cell, pot_eq, n_steps, adaptive, opts)
+
+    logger.info("Solving IV sweep on device...")
+    swept = sweep(cell, pot_eq, n_steps, adaptive, opts)
+    n = int(swept["n"])
+    truncated = tree_util.tree_map(
+        lambda x: x[:n],
+        {key: swept[key]
+         for key in ["iv", "pots", "converged"]})
+
+    return dict(swept, n=n, **truncated)
+
+
+@partial(custom_vjp, nondiff_argnums=(2, 3, 4, 5))
+def sweep_iv(cell: PVCell,
+             pot_eq: Potentials,
+             n_steps: i64 = None,
+             adaptive: bool = False,
+             parallel: bool = False,
+             opts: SolverOptions = SolverOptions(),
+             anchors: tuple = None) -> dict:
+    """IV curve and solutions of a cell, with implicit differentiation at
+    each converged voltage for gradient
+
+    Only the voltages and converged solutions are kept for the backward
+    pass, which scans over the voltages and rebuilds the Jacobian at each
+    one, so reverse mode memory grows with steps x N instead of with every
+    Newton iteration. Supports reverse mode only.
+
+    Args:
+        cell (PVCell): An initialized cell
+        pot_eq (Potentials): Equilibrium solution
+        n_steps (i64, optional): How many voltage steps to solve for, see
+            simulate. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        parallel (bool, optional): Whether to solve all voltages at once,
+            see simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+        anchors (tuple, optional): Previous curve to interpolate guesses
+            from, see sweep_parallel. Treated as constant. Defaults to None.
+
+    Returns:
+        dict: Dictionary of results: "iv" is a tuple (v, i) of the IV curve
+            in V and A/cm^2, "pots" are the solutions stacked along the
+            first axis
+    """
+    out, _ = sweep_iv_fwd(cell, pot_eq, n_steps, adaptive, parallel, opts,
+                          anchors)
+
+    return out
+
+
+def sweep_iv_fwd(cell, pot_eq, n_steps, adaptive, parallel, opts, anchors):
+
+    swept = run_sweep(cell, pot_eq, n_steps, adaptive, parallel, anchors,
+                      opts)
+    out = {"iv": swept["iv"], "pots": swept["pots"]}
+    res = (cell, swept["iv"][0] / scales.energy, swept["pots"], pot_eq,
+           anchors)
+
+    return out, res
+
+
+def sweep_iv_bwd(n_steps, adaptive, parallel, opts, res, g):
+
+    cell, voltages, pots, pot_eq, anchors = res
+    dcurrents = g["iv"][1] * scales.current
+    dpots = g["pots"]
+
+    # At each voltage, one transposed block tridiagonal solve for the adjoint
+    # of the current and solution, see adjoint.solve_pdd_adjoint. Voltages
+    # and the guesses that started each Newton iteration are constants.
+    def step(dcell, xs):
+        v, pot, dj, dpot = xs
+        bound = bcond.boundary(cell, v)
+        spJ = residual.comp_F_deriv(cell, bound, pot)
+        gx = solver.pot2vec(grad(current.total_current, 1)(cell, pot))
+        rhs = dj * gx + solver.pot2vec(dpot)
+        lam = linalg.blocktsolve(linalg.factor(spJ, "block"), rhs)
+
+        def lagrangian(cell):
+            F = residual.comp_F(cell, bcond.boundary(cell, v), pot)
+            return dj * current.total_current(cell, pot) - jnp.dot(lam, F)
+
+        dcell = tree_util.tree_map(jnp.add, dcell, grad(lagrangian)(cell))
+
+        return dcell, None
+
+    dcell_ini = tree_util.tree_map(jnp.zeros_like, cell)
+    dcell, _ = lax.scan(step, dcell_ini, (voltages, pots, dcurrents, dpots))
+
+    return (dcell, tree_util.tree_map(jnp.zeros_like, pot_eq),
+            tree_util.tree_map(jnp.zeros_like, anchors))
+
+
+sweep_iv.defvjp(sweep_iv_fwd, sweep_iv_bwd)
+
+
+def efficiency(design: PVDesign,
+               ls: LightSource = incident_light(),
+               optics: bool = True,
+               adaptive: bool = False,
+               opts: SolverOptions = SolverOptions()) -> f64:
+    """Power conversion efficiency of a cell, for reverse mode
+    differentiation
+
+    Gives the same efficiency as simulate, but its gradient costs one
+    adjoint solve per voltage instead of differentiating through the whole
+    sweep, see sweep_iv.
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource): A light source
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        f64: Power conversion efficiency
+    """
+    pot_eq = equilibrium(design, ls, opts)
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    pot_ini = mesh.pad_pot(pot_eq, cell.Eg.size)
+    dim_voltages, dim_currents = sweep_iv(cell, pot_ini, None, adaptive,
+                                          False, opts)["iv"]
+    pmax, _ = spline.calcPmax(dim_voltages,
+                              dim_currents * 1e4)  # A/cm^2 -> A/m2
+
+    return pmax / jnp.sum(ls.P_in)
+
+
+def efficiency_and_grad(design: PVDesign,
+                        ls: LightSource = incident_light(),
+                        optics: bool = True,
+                        adaptive: bool = False,
+                        opts: SolverOptions = SolverOptions()
+                        ) -> Tuple[f64, PVDesign]:
+    """Power conversion efficiency of a cell and its gradient
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource): A light source
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        Tuple[f64, PVDesign]: Efficiency and its gradient with respect to
+            every parameter of the design
+    """
+    return value_and_grad(efficiency)(design, ls, optics, adaptive, opts)
+
+
+@partial(jit, static_argnums=(2, 3, 4, 5))
+def simulate_design(design: PVDesign,
+                    ls: LightSource,
+                    optics: bool = True,
+                    n_steps: i64 = None,
+                    adaptive: bool = False,
+                    opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve equilibrium and the IV sweep for a cell in a single compiled
+    function, without logging or Python control flow
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource): A light source
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        n_steps (i64, optional): How many voltage steps to solve for, see
+            sweep. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        opts (SolverOptions, optional): Newton solver configuration. The
+            Newton loops are always compiled. Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of results of sweep, with "pots" replaced by the
+            efficiency "eff"
+    """
+    opts = dataclasses.replace(opts, compiled=True)
+    cell = init_cell(design, ls, optics=optics)
+    bound_eq = bcond.boundary_eq(cell)
+    pot_ini = solver.eq_guess_seq(cell, opts)
+    pot_eq = solver.solve_eq(cell, bound_eq, pot_ini, opts)
+
+    results = sweep(cell, pot_eq, n_steps, adaptive, opts)
+    results.pop("pots")
+    results["eff"] = results["mpp"] / jnp.sum(ls.P_in)
+
+    return results
+
+
+def simulate_batch(designs: Union[PVDesign, List[PVDesign]],
+                   ls: LightSource = incident_light(),
+                   optics: bool = True,
+                   n_steps: i64 = None,
+                   adaptive: bool = False,
+                   verbose: bool = True,
+                   opts: SolverOptions = SolverOptions()) -> dict:
+    """Solve equilibrium and out-of-equilibrium systems for many cells of the
+    same grid size at once
+
+    The designs are stacked and simulate_design is mapped over them with
+    vmap, so the whole population runs through one compiled kernel. Each
+    design stops its sweep on its own: once it is done, its entries are left
+    unchanged while the others carry on.
+
+    Args:
+        designs (Union[PVDesign, List[PVDesign]]): A list of cells with the
+            same number of grid points, or a single PVDesign whose fields
+            are already stacked along a leading batch axis
+        ls (LightSource): A light source, shared by all cells
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        n_steps (i64, optional): How many voltage steps to solve for, see
+            sweep. Defaults to None.
+        adaptive (bool, optional): Whether to adapt the voltage step, see
+            simulate. Defaults to False.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration. The
+            Newton loops are always compiled. Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of stacked results, with the batch along the first
+            axis: "n" is the number of voltage steps solved, "iv" is a tuple
+            (v, i) of the IV curves in V and A/cm^2, "converged" flags the
+            steps whose Newton iteration converged, "mpp" is the maximum
+            power found in W, "vmax" its voltage and "eff" the power
+            conversion efficiency. Entries past the first "n" steps of each
+            IV curve are padding.
+    """
+    if not isinstance(designs, PVDesign):
+        designs = tree_util.tree_map(lambda *xs: jnp.stack(xs), *designs)
+
+    n_batch = designs.grid.shape[0]
+    if verbose:
+        logger.info(f"Solving {n_batch} designs on device...")
+
+    results = vmap(lambda design: simulate_design(
+        design, ls, optics, n_steps, adaptive, opts))(designs)
+
+    if verbose:
+        logger.info(f"Finished {n_batch} simulations.")
+
+    return results
+
+
 def eff_at_bias(design: PVDesign,
                 bias: f64,
                 pot_ini: Potentials,
                 ls: LightSource = incident_light(),
                 optics: bool = True,
-                verbose: bool = True) -> Tuple[f64, Potentials]:
+                verbose: bool = True,
+                opts: SolverOptions = SolverOptions()
+                ) -> Tuple[f64, Potentials]:
     if not verbose:
         temp = logger.level
         logger.setLevel("WARNING")
 
-    cell = init_cell(design, ls, optics=optics)
-    j, pot = adjoint.solve_pdd(cell, bias / scales.energy, pot_ini)
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    pot_ini = mesh.pad_pot(pot_ini, cell.Eg.size)
+    j, pot = adjoint.solve_pdd(cell, bias / scales.energy, pot_ini, opts)
     current = j * scales.current
     power = current * bias
     eff = power * 1e4 / jnp.sum(ls.P_in)
@@ -381,4 +1290,286 @@ def eff_at_bias(design: PVDesign,
     if not verbose:
         logger.setLevel(temp)
 
-    return eff, pot
+    return eff, mesh.unpad(pot, design.grid.size)
+
+
+def vprobe(cell: PVCell,
+           v: f64,
+           pot_ini: Potentials,
+           aux: dict = None,
+           opts: SolverOptions = SolverOptions()) -> tuple:
+
+    # Current and solution at bias v together with their derivatives with
+    # respect to v. These are the Schur complement of the PDD system bordered
+    # by the bias: F_pot dpot/dv = -F_v and dJ/dv = J_pot dpot/dv, solved
+    # with the factorization of the last Newton iteration.
+    j, pot, aux = adjoint.solve_pdd_reuse(cell, v, pot_ini, aux, opts)
+
+    bound, dbound = jvp(lambda v: bcond.boundary(cell, v), (f64(v), ),
+                        (f64(1), ))
+    zerodcell = tree_util.tree_map(jnp.zeros_like, cell)
+    dpot = solver.tangent(cell, bound, pot, aux["fact"], zerodcell, dbound,
+                          opts)
+    _, dj = jvp(current.total_current, (cell, pot), (zerodcell, dpot))
+
+    return j, dj, pot, dpot, aux
+
+
+@partial(custom_jvp, nondiff_argnums=(2, ))
+def vsearch(cell: PVCell,
+            pot_ini: Potentials,
+            target: str,
+            opts: SolverOptions = SolverOptions(),
+            warm: tuple = None,
+            sc: tuple = None) -> tuple:
+
+    # Search for the bias at which g = J (target "voc") or g = d(JV)/dV =
+    # J + V dJ/dV (target "mpp") vanishes. This is an outer loop over the
+    # bias, not a Newton solve of the system bordered by the bias: every
+    # probe is a full solve of the PDD system at fixed bias, warm started
+    # from the tangent of the nearest probe. Steps are Newton steps on g for
+    # a diode-like current J = Jsc - J0 exp(V / a), with a fitted to the
+    # current and its slope at the last point, which is much closer to the
+    # actual current than a linear model near the knee. For the maximum
+    # power point, whose g involves the curvature of the current, secant
+    # steps are taken instead once g has changed sign. Starting from short
+    # circuit, steps are at most a coarse step long until g changes sign,
+    # and then kept within the bracket by bisection. A tuple warm = (v, pot)
+    # of a nearby operating point, e.g. of the same cell under similar
+    # light, is probed right after short circuit. A tuple sc = (j, dj, pot,
+    # dpot, aux) of vprobe at short circuit, e.g. shared by the searches
+    # for both targets, replaces the probe there, and pot_ini is then
+    # unused. An error is logged if the bias has not settled after n_newton
+    # probes.
+
+    def evaluate(v, guess, aux):
+        logger.info("Solving for {:.4f} V...".format(v * scales.energy))
+        j, dj, pot, dpot, aux = vprobe(cell, v, guess, aux, opts)
+        j, dj = np.float64(float(j)), np.float64(float(dj))
+        g = j if target == "voc" else j + v * dj
+        return v, g, j, dj, pot, dpot, aux
+
+    def probe(v, point):
+        _, _, _, _, pot, dpot, aux = point
+        guess = tree_util.tree_map(lambda x, dx: x + dx * (v - point[0]),
+                                   pot, dpot)
+        return evaluate(v, guess, aux)
+
+    @np.errstate(divide="ignore", invalid="ignore")
+    def model(point, last):
+        # NaN or infinite where the model does not apply, e.g. at short
+        # circuit, which the bracketing below falls back from
+        v, g, j, dj = point[:4]
+        a = (jsc - j) / -dj
+        if target == "voc":
+            return v + a * np.log(jsc / (jsc - j))
+        if hi is None:
+            return v - g / (dj * (2 + v / a))
+        return v - g * (v - last[0]) / (g - last[1])
+
+    if sc is None:
+        sc = vprobe(cell, 0., pot_ini, None, opts)
+    j, dj, pot, dpot, aux = sc
+    j, dj = np.float64(float(j)), np.float64(float(dj))
+    jsc = j
+    point = 0., j, j, dj, pot, dpot, aux
+    last, lo, hi = point, point, None
+    dv = solver.vincr(cell, 5)
+    tol = DIM_V_TOL / scales.energy
+
+    if warm is not None:
+        last, point = point, evaluate(np.float64(float(warm[0])), warm[1],
+                                      aux)
+        if point[1] > 0:
+            lo = point
+        else:
+            hi = point
+
+    for _ in range(solver.n_newton):
+        vnew = model(point, last)
+        upper = lo[0] + dv if hi is None else hi[0]
+        if not lo[0] < vnew < upper:
+            vnew = upper if hi is None else (lo[0] + hi[0]) / 2
+        if hi is None or abs(vnew - lo[0]) < abs(vnew - hi[0]):
+            near = lo
+        else:
+            near = hi
+        last, point = point, probe(vnew, near)
+        if point[1] > 0:
+            lo = point
+        else:
+            hi = point
+        if hi is not None and abs(point[0] - last[0]) < tol:
+            break
+    else:
+        logger.error("    Search for the {} did not converge in {} probes, "
+                     "last step {:.2e} V".format(
+                         "open circuit voltage" if target == "voc" else
+                         "maximum power point", solver.n_newton,
+                         abs(point[0] - last[0]) * scales.energy))
+
+    v, _, _, dj, pot, _, _ = point
+
+    return f64(v), f64(dj), pot
+
+
+@vsearch.defjvp
+def vsearch_jvp(target, primals, tangents):
+
+    # The search only locates the operating point, and its result is treated
+    # as a constant. Gradients come from the final solve at that point.
+    cell, pot_ini, opts, warm, sc = primals
+    primal_out = vsearch(cell, pot_ini, target, opts, warm, sc)
+
+    return primal_out, tree_util.tree_map(jnp.zeros_like, primal_out)
+
+
+def short_circuit(design: PVDesign,
+                  ls: LightSource = incident_light(),
+                  pot_ini: Potentials = None,
+                  optics: bool = True,
+                  verbose: bool = True,
+                  opts: SolverOptions = SolverOptions()
+                  ) -> Tuple[f64, Potentials]:
+    """Solve for the short circuit current directly
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource, optional): A light source. Defaults to
+            incident_light().
+        pot_ini (Potentials, optional): Initial guess of solution. If None,
+            a guess is made from the equilibrium solution. Defaults to None.
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        Tuple[f64, Potentials]: Short circuit current in A/cm^2 and solution
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    if pot_ini is None:
+        pot_eq = equilibrium(design, ls, opts)
+        pot_ini = solver.ooe_guess_seq(cell, pot_eq, opts)
+    pot_ini = mesh.pad_pot(pot_ini, cell.Eg.size)
+    j, pot = adjoint.solve_pdd(cell, 0., pot_ini, opts)
+
+    if not verbose:
+        logger.setLevel(temp)
+
+    return j * scales.current, mesh.unpad(pot, design.grid.size)
+
+
+def open_circuit(design: PVDesign,
+                 ls: LightSource = incident_light(),
+                 pot_ini: Potentials = None,
+                 optics: bool = True,
+                 verbose: bool = True,
+                 opts: SolverOptions = SolverOptions()
+                 ) -> Tuple[f64, Potentials]:
+    """Search for the open circuit voltage, without a full IV sweep
+
+    The bias is found by an outer search of diode-model, secant and
+    bisection steps, each probe being a full solve at fixed bias, which
+    usually takes a handful of solves. An error is logged if the search
+    does not converge.
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource, optional): A light source. Defaults to
+            incident_light().
+        pot_ini (Potentials, optional): Initial guess of the solution at
+            short circuit. If None, a guess is made from the equilibrium
+            solution. Defaults to None.
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        Tuple[f64, Potentials]: Open circuit voltage in V and solution
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    if pot_ini is None:
+        pot_eq = equilibrium(design, ls, opts)
+        pot_ini = solver.ooe_guess_seq(cell, pot_eq, opts)
+    pot_ini = mesh.pad_pot(pot_ini, cell.Eg.size)
+    voc, dj, pot = vsearch(cell, pot_ini, "voc", opts)
+
+    # A last Newton step on J(Voc) = 0 leaves Voc unchanged and carries the
+    # implicit function gradient dVoc = -dJ / (dJ/dV)
+    j, pot = adjoint.solve_pdd(cell, voc, pot, opts)
+    voc = voc - j / dj
+
+    if not verbose:
+        logger.setLevel(temp)
+
+    return voc * scales.energy, mesh.unpad(pot, design.grid.size)
+
+
+def max_power(design: PVDesign,
+              ls: LightSource = incident_light(),
+              pot_ini: Potentials = None,
+              optics: bool = True,
+              verbose: bool = True,
+              opts: SolverOptions = SolverOptions()) -> dict:
+    """Search for the maximum power point, without a full IV sweep
+
+    The bias at which d(JV)/dV vanishes is found as in open_circuit, by an
+    outer search over the bias whose probes are full solves at fixed bias.
+    An error is logged if the search does not converge.
+
+    Args:
+        design (PVDesign): A cell
+        ls (LightSource, optional): A light source. Defaults to
+            incident_light().
+        pot_ini (Potentials, optional): Initial guess of the solution at
+            short circuit. If None, a guess is made from the equilibrium
+            solution. Defaults to None.
+        optics (bool, optional): Whether to use optical model, see simulate.
+            Defaults to True.
+        verbose (bool, optional): Whether to log progress. Defaults to True.
+        opts (SolverOptions, optional): Newton solver configuration.
+            Defaults to SolverOptions().
+
+    Returns:
+        dict: Dictionary of results: "mpp" is the maximum power in W, "vmax"
+            its voltage in V, "eff" is the power conversion efficiency and
+            "pot" the solution at the maximum power point
+    """
+    if not verbose:
+        temp = logger.level
+        logger.setLevel("WARNING")
+
+    cell = init_cell(design, ls, optics=optics, bucket=opts.bucket)
+    if pot_ini is None:
+        pot_eq = equilibrium(design, ls, opts)
+        pot_ini = solver.ooe_guess_seq(cell, pot_eq, opts)
+    pot_ini = mesh.pad_pot(pot_ini, cell.Eg.size)
+    vmax, _, pot = vsearch(cell, pot_ini, "mpp", opts)
+
+    # d(JV)/dV vanishes at vmax, so the gradient of the maximum power only
+    # goes through the current at fixed voltage
+    j, pot = adjoint.solve_pdd(cell, vmax, pot, opts)
+    pmax = vmax * scales.energy * j * scales.current * 1e4  # A/cm^2 -> A/m2
+    eff = pmax / jnp.sum(ls.P_in)
+
+    if not verbose:
+        logger.setLevel(temp)
+
+    return {
+        "mpp": pmax,
+        "vmax": vmax * scales.energy,
+        "eff": eff,
+        "pot": mesh.unpad(pot, design.grid.size)
+    }
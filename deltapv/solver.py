@@ -1,6 +1,8 @@
-from deltapv import objects, residual, linalg, physics, scales, util
-from jax import numpy as jnp, jit, custom_jvp, jvp, vmap, lax
-from typing import Tuple
+from deltapv import (objects, residual, linalg, physics, scales, bcond, mesh,
+                     util)
+from jax import (numpy as jnp, jit, custom_jvp, jvp, vmap, lax, tree_util,
+                 eval_shape)
+from typing import Callable, Tuple
 
 import logging
 logger = logging.getLogger("deltapv")
@@ -9,10 +11,15 @@ PVCell = objects.PVCell
 LightSource = objects.LightSource
 Potentials = objects.Potentials
 Boundary = objects.Boundary
+SolverOptions = objects.SolverOptions
 Array = util.Array
 f64 = util.f64
 i64 = util.i64
 n_lnsrch = 500
+n_newton = 100
+tol_newton = 1e-6
+n_target = {"full": 6, "chord": 12, "broyden": 12}
+tol_curv = 1e-3
 
 
 def vincr(cell: PVCell, num_vals: i64 = 20) -> f64:
@@ -40,6 +47,46 @@ def ooe_guess(cell: PVCell, pot_eq: Potentials) -> Potentials:
     return pot_guess
 
 
+def eq_guess_seq(cell: PVCell, opts: SolverOptions) -> Potentials:
+
+    # Grid sequencing: the guess on each grid is the equilibrium solution on
+    # the next coarser grid, interpolated, over opts.levels coarsenings
+
+    def guess(cell, k):
+        bound_eq = bcond.boundary_eq(cell)
+        if k == 0:
+            return eq_guess(cell, bound_eq)
+        coarse = mesh.coarsen(cell)
+        pot_ini = guess(coarse, k - 1)
+        logger.info("Solving equilibrium on {} nodes...".format(
+            coarse.Eg.size))
+        pot = solve_eq(coarse, bcond.boundary_eq(coarse), pot_ini, opts)
+        return mesh.prolong(pot, cell)
+
+    return guess(cell, mesh.levels(cell, opts.levels))
+
+
+def ooe_guess_seq(cell: PVCell, pot_eq: Potentials,
+                  opts: SolverOptions) -> Potentials:
+
+    # Grid sequencing for the first out-of-equilibrium step at zero bias,
+    # see eq_guess_seq. The equilibrium solution is padded to the size of
+    # the cell if the cell is.
+    pot_eq = mesh.pad_pot(pot_eq, cell.Eg.size)
+
+    def guess(cell, pot_eq, k):
+        if k == 0:
+            return ooe_guess(cell, pot_eq)
+        coarse = mesh.coarsen(cell)
+        pot_ini = guess(coarse, mesh.restrict(pot_eq), k - 1)
+        logger.info("Solving for 0.00 V on {} nodes...".format(
+            coarse.Eg.size))
+        pot = solve(coarse, bcond.boundary(coarse, 0.), pot_ini, opts)
+        return mesh.prolong(pot, cell)
+
+    return guess(cell, pot_eq, mesh.levels(cell, opts.levels))
+
+
 @jit
 def logdamp(move: Array) -> Array:
 
@@ -159,9 +206,130 @@ def quadguess(pot: Potentials, potl: Potentials, potll: Potentials):
                       3 * fp - 3 * fpl + fpll)
 
 
+def genquadguess(pot: Potentials, potl: Potentials, potll: Potentials,
+                 dx1: f64, dx2: f64, dx3: f64):
+
+    # Quadratic extrapolation through nonuniform points, with dx1 and dx2 the
+    # spacings of pot from potl and of potl from potll, and dx3 the step
+    # ahead. Reduces to quadguess for equal spacings.
+    w = (dx3 + dx1) * (dx3 + dx1 + dx2) / (dx1 * (dx1 + dx2))
+    wl = -dx3 * (dx3 + dx1 + dx2) / (dx1 * dx2)
+    wll = dx3 * (dx3 + dx1) / ((dx1 + dx2) * dx2)
+
+    return Potentials(w * pot.phi + wl * potl.phi + wll * potll.phi,
+                      w * pot.phi_n + wl * potl.phi_n + wll * potll.phi_n,
+                      w * pot.phi_p + wl * potl.phi_p + wll * potll.phi_p)
+
+
+def vadapt(dv: f64, niter: f64, target: f64, vs: Array, js: Array,
+           jref: f64, dv_min: f64, dv_max: f64) -> f64:
+
+    # Next voltage step. The step grows or shrinks by up to a factor of two
+    # to keep the Newton iterations per step near target, which is taken
+    # from n_target for the Newton variant in use, and is limited
+    # such that the quadratic term of the current over one step, estimated
+    # from the last three points vs, js (oldest first), stays below
+    # tol_curv * |jref|. With fewer than three distinct points the curvature
+    # is undefined and only the iteration count is used. The step is treated
+    # as a constant when differentiating.
+    grow = jnp.clip(target / jnp.maximum(niter, 1), 0.5, 2)
+    s1 = (js[2] - js[1]) / (vs[2] - vs[1])
+    s0 = (js[1] - js[0]) / (vs[1] - vs[0])
+    curv = 2 * jnp.abs(s1 - s0) / (vs[2] - vs[0])
+    curv = jnp.where(jnp.isnan(curv), 0, curv)
+    dv_curv = jnp.sqrt(2 * tol_curv * jnp.abs(jref) / curv)
+
+    return lax.stop_gradient(
+        jnp.clip(jnp.minimum(grow * dv, dv_curv), dv_min, dv_max))
+
+
+def blank(update: Callable, pot_ini: Potentials,
+          stats: dict) -> dict:
+
+    # Zero statistics with the structure returned by update, and a unit error
+    # so that an iteration starting from them always runs
+
+    _, stats_shape = eval_shape(update, pot_ini, stats)
+    stats_ini = tree_util.tree_map(lambda s: jnp.zeros(s.shape, s.dtype),
+                                   stats_shape)
+    stats_ini["error"] = jnp.ones_like(stats_ini["error"])
+
+    return stats_ini
+
+
+def iterate(update: Callable, pot_ini: Potentials, stats_ini: dict,
+            active: bool = True) -> Tuple[Potentials, dict]:
+
+    # Newton iteration as a lax.while_loop, so that no value has to leave the
+    # device between iterations. Convergence is checked the same way as in
+    # the Python loops: the iteration stops once |p| <= tol_newton, or as soon
+    # as |p| becomes NaN or exactly zero, which signals a failed linear solve.
+    # The whole statistics dictionary of the last step, including its
+    # Jacobian and factorization, is carried along and passed to the next.
+
+    def cond_fun(state):
+        _, stats, niter, _, _ = state
+        return jnp.logical_and(
+            active,
+            jnp.logical_and(niter < n_newton, stats["error"] > tol_newton))
+
+    def body_fun(state):
+        pot, stats, niter, errors, resids = state
+        pot_new, stats_new = update(pot, stats)
+        errors = errors.at[niter].set(stats_new["error"])
+        resids = resids.at[niter].set(stats_new["resid"])
+        return pot_new, stats_new, niter + 1, errors, resids
+
+    state_ini = (pot_ini, stats_ini, i64(0), jnp.full(n_newton, jnp.nan),
+                 jnp.full(n_newton, jnp.nan))
+    pot, stats, niter, errors, resids = lax.while_loop(
+        cond_fun, body_fun, state_ini)
+
+    stats = dict(stats, niter=niter, errors=errors, resids=resids)
+
+    return pot, stats
+
+
+def failed(stats: dict) -> bool:
+
+    return jnp.logical_or(jnp.isnan(stats["error"]), stats["error"] == 0)
+
+
+def fallback(sparse: Callable, dense: Callable, pot_ini: Potentials,
+             sparse_ini: dict, dense_ini: dict,
+             refactor: Callable) -> Tuple[Potentials, dict]:
+
+    # The dense iteration only runs when the sparse one failed. It is not
+    # wrapped in a lax.cond so that under vmap only the failed members of a
+    # batch iterate, instead of every member executing both branches. Entries
+    # that only the sparse iteration keeps are passed through unchanged,
+    # except the factorization, which the dense steps do not compute: the
+    # Jacobian of the last dense iteration is factored once by refactor.
+
+    pot_sp, stats_sp = iterate(sparse, pot_ini, sparse_ini)
+    use_dense = failed(stats_sp)
+    pot_de, stats_de = iterate(dense, pot_ini, dense_ini, active=use_dense)
+
+    common = {key: stats_sp[key] for key in stats_de}
+    pot, common = tree_util.tree_map(
+        lambda de, sp: jnp.where(use_dense, de, sp), (pot_de, stats_de),
+        (pot_sp, common))
+    stats = dict(stats_sp, **common)
+    stats["fact"] = lax.cond(use_dense, refactor, lambda _: stats_sp["fact"],
+                             stats["jac"])
+    stats["dense"] = use_dense
+    stats["converged"] = jnp.logical_and(
+        jnp.logical_not(failed(stats)), stats["error"] <= tol_newton)
+
+    return pot, stats
+
+
 @jit
-def step_eq_dense(cell: PVCell, bound: Boundary,
-                  pot: Potentials) -> Tuple[Potentials, f64]:
+def step_eq_dense(cell: PVCell,
+                  bound: Boundary,
+                  pot: Potentials,
+                  opts: SolverOptions = SolverOptions()
+                  ) -> Tuple[Potentials, dict]:
 
     Feq = residual.comp_F_eq(cell, bound, pot)
     spJeq = residual.comp_F_eq_deriv(cell, bound, pot)
@@ -174,18 +342,26 @@ def step_eq_dense(cell: PVCell, bound: Boundary,
 
     pot_new = Potentials(pot.phi + dx, pot.phi_n, pot.phi_p)
 
-    stats = {"error": error, "resid": resid}
+    stats = {
+        "error": error,
+        "resid": resid,
+        "jac": spJeq
+    }
 
     return pot_new, stats
 
 
 @jit
-def step_eq(cell: PVCell, bound: Boundary,
-            pot: Potentials) -> Tuple[Potentials, f64]:
+def step_eq(cell: PVCell,
+            bound: Boundary,
+            pot: Potentials,
+            opts: SolverOptions = SolverOptions()
+            ) -> Tuple[Potentials, dict]:
 
     Feq = residual.comp_F_eq(cell, bound, pot)
     spJeq = residual.comp_F_eq_deriv(cell, bound, pot)
-    p = linalg.linsol(spJeq, -Feq, tol=1e-6)
+    fact = linalg.factor(spJeq, opts.linsol, 1)
+    p = linalg.factsol(spJeq, fact, -Feq, 1e-6, opts.linsol)
 
     error = jnp.max(jnp.abs(p))
     resid = jnp.linalg.norm(Feq)
@@ -193,21 +369,59 @@ def step_eq(cell: PVCell, bound: Boundary,
 
     pot_new = Potentials(pot.phi + dx, pot.phi_n, pot.phi_p)
 
-    stats = {"error": error, "resid": resid}
+    stats = {"error": error, "resid": resid, "jac": spJeq, "fact": fact}
 
     return pot_new, stats
 
 
-def solve_eq_dense(cell: PVCell, bound: Boundary,
-                   pot_ini: Potentials) -> Potentials:
+@jit
+def newton_eq(cell: PVCell,
+              bound: Boundary,
+              pot_ini: Potentials,
+              opts: SolverOptions = SolverOptions()
+              ) -> Tuple[Potentials, dict]:
+    """Solve the equilibrium system with the Newton loop compiled on device
+
+    Args:
+        cell (PVCell): An initialized cell
+        bound (Boundary): Equilibrium boundary conditions
+        pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Solver configuration. Defaults to
+            SolverOptions().
+
+    Returns:
+        Tuple[Potentials, dict]: Solution and iteration statistics: "niter",
+            final "error" (|p|) and "resid" (|F|), their per-iteration
+            histories "errors" and "resids" (NaN past the last iteration),
+            the flags "dense" and "converged", and the Jacobian "jac" of the
+            last iteration with its factorization "fact"
+    """
+    def sparse(pot, stats):
+        return step_eq(cell, bound, pot, opts)
+
+    def dense(pot, stats):
+        return step_eq_dense(cell, bound, pot, opts)
+
+    def refactor(jac):
+        return linalg.factor(jac, opts.linsol, 1)
+
+    return fallback(sparse, dense, pot_ini, blank(sparse, pot_ini, {}),
+                    blank(dense, pot_ini, {}), refactor)
+
+
+def solve_eq_dense_aux(cell: PVCell,
+                       bound: Boundary,
+                       pot_ini: Potentials,
+                       opts: SolverOptions = SolverOptions()
+                       ) -> Tuple[Potentials, dict]:
 
     pot = pot_ini
     error = 1
     niter = 0
 
-    while niter < 100 and error > 1e-6:
+    while niter < n_newton and error > tol_newton:
 
-        pot, stats = step_eq_dense(cell, bound, pot)
+        pot, stats = step_eq_dense(cell, bound, pot, opts)
         error = stats["error"]
         resid = stats["resid"]
         niter += 1
@@ -218,19 +432,50 @@ def solve_eq_dense(cell: PVCell, bound: Boundary,
             logger.critical("    Dense solver failed! It's all over.")
             raise SystemExit
 
+    # Only the Jacobian of the last iteration is factored
+    fact = linalg.factor(stats["jac"], opts.linsol, 1)
+
+    return pot, dict(stats, fact=fact, niter=niter)
+
+
+def solve_eq_dense(cell: PVCell,
+                   bound: Boundary,
+                   pot_ini: Potentials,
+                   opts: SolverOptions = SolverOptions()) -> Potentials:
+
+    pot, _ = solve_eq_dense_aux(cell, bound, pot_ini, opts)
+
     return pot
 
 
-@custom_jvp
-def solve_eq(cell: PVCell, bound: Boundary, pot_ini: Potentials) -> Potentials:
+def solve_eq_aux(cell: PVCell,
+                 bound: Boundary,
+                 pot_ini: Potentials,
+                 opts: SolverOptions = SolverOptions()
+                 ) -> Tuple[Potentials, dict]:
+    """Solve the equilibrium system and keep the last Newton iteration
+
+    Args:
+        cell (PVCell): An initialized cell
+        bound (Boundary): Equilibrium boundary conditions
+        pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Solver configuration. Defaults to
+            SolverOptions().
+
+    Returns:
+        Tuple[Potentials, dict]: Solution and statistics of the last
+            iteration, including its Jacobian "jac" and factorization "fact"
+    """
+    if opts.compiled:
+        return newton_eq(cell, bound, pot_ini, opts)
 
     pot = pot_ini
     error = 1
     niter = 0
 
-    while niter < 100 and error > 1e-6:
+    while niter < n_newton and error > tol_newton:
 
-        pot, stats = step_eq(cell, bound, pot)
+        pot, stats = step_eq(cell, bound, pot, opts)
         error = stats["error"]
         resid = stats["resid"]
         niter += 1
@@ -239,7 +484,18 @@ def solve_eq(cell: PVCell, bound: Boundary, pot_ini: Potentials) -> Potentials:
 
         if jnp.isnan(error) or error == 0:
             logger.error("    Sparse solver failed! Switching to dense.")
-            return solve_eq_dense(cell, bound, pot_ini)
+            return solve_eq_dense_aux(cell, bound, pot_ini, opts)
+
+    return pot, dict(stats, niter=niter)
+
+
+@custom_jvp
+def solve_eq(cell: PVCell,
+             bound: Boundary,
+             pot_ini: Potentials,
+             opts: SolverOptions = SolverOptions()) -> Potentials:
+
+    pot, _ = solve_eq_aux(cell, bound, pot_ini, opts)
 
     return pot
 
@@ -247,9 +503,9 @@ def solve_eq(cell: PVCell, bound: Boundary, pot_ini: Potentials) -> Potentials:
 @solve_eq.defjvp
 def solve_eq_jvp(primals, tangents):
 
-    cell, bound, pot_ini = primals
-    dcell, dbound, _ = tangents
-    sol = solve_eq(cell, bound, pot_ini)
+    cell, bound, pot_ini, opts = primals
+    dcell, dbound, _, _ = tangents
+    sol, aux = solve_eq_aux(cell, bound, pot_ini, opts)
 
     zerodpot = Potentials(jnp.zeros_like(sol.phi), jnp.zeros_like(sol.phi_n),
                           jnp.zeros_like(sol.phi_p))
@@ -257,9 +513,10 @@ def solve_eq_jvp(primals, tangents):
     _, rhs = jvp(residual.comp_F_eq, (cell, bound, sol),
                  (dcell, dbound, zerodpot))
 
+    # The factorization of the last Newton iteration preconditions the solve
+    # with the Jacobian at the solution, so no new factorization is needed
     spF_eq_pot = residual.comp_F_eq_deriv(cell, bound, sol)
-    F_eq_pot = linalg.sparse2dense(spF_eq_pot)
-    dF_eq = jnp.linalg.solve(F_eq_pot, -rhs)
+    dF_eq = linalg.refsol(spF_eq_pot, aux["fact"], -rhs, 1e-12, opts.linsol)
 
     primal_out = sol
     tangent_out = Potentials(dF_eq, jnp.zeros_like(sol.phi_n),
@@ -290,10 +547,11 @@ def step_dense(cell: PVCell,
                pot: Potentials,
                pl: Array,
                dxl: Array,
-               beta: f64 = 0.9) -> Tuple[Potentials, dict]:
+               beta: f64 = 0.9,
+               opts: SolverOptions = SolverOptions()
+               ) -> Tuple[Potentials, dict]:
 
-    F = residual.comp_F(cell, bound, pot)
-    spJ = residual.comp_F_deriv(cell, bound, pot)
+    F, spJ = residual.comp_F_and_J(cell, bound, pot)
     J = linalg.sparse2dense(spJ)
     p = logdamp(jnp.linalg.solve(J, -F))
     dx = acceleration(p, pl, dxl, beta)
@@ -301,13 +559,22 @@ def step_dense(cell: PVCell,
 
     error = jnp.max(jnp.abs(p))
     resid = jnp.linalg.norm(F)
-    stats = {"error": error, "resid": resid, "p": p, "dx": dx}
+    stats = {
+        "error": error,
+        "resid": resid,
+        "p": p,
+        "dx": dx,
+        "jac": spJ
+    }
 
     return pot_new, stats
 
 
-def solve_dense(cell: PVCell, bound: Boundary,
-                pot_ini: Potentials) -> Potentials:
+def solve_dense_aux(cell: PVCell,
+                    bound: Boundary,
+                    pot_ini: Potentials,
+                    opts: SolverOptions = SolverOptions()
+                    ) -> Tuple[Potentials, dict]:
 
     pot = pot_ini
     error = 1
@@ -315,9 +582,9 @@ def solve_dense(cell: PVCell, bound: Boundary,
     pl = jnp.zeros(3 * pot.phi.size)
     dxl = jnp.zeros(3 * pot.phi.size)
 
-    while niter < 100 and error > 1e-6:
+    while niter < n_newton and error > tol_newton:
 
-        pot, stats = step_dense(cell, bound, pot, pl, dxl)
+        pot, stats = step_dense(cell, bound, pot, pl, dxl, opts=opts)
         error = stats["error"]
         resid = stats["resid"]
         pl = stats["p"]
@@ -330,6 +597,19 @@ def solve_dense(cell: PVCell, bound: Boundary,
             logger.critical("    Dense solver failed! It's all over.")
             raise SystemExit
 
+    # Only the Jacobian of the last iteration is factored
+    fact = linalg.factor(stats["jac"], opts.linsol)
+
+    return pot, dict(stats, fact=fact, niter=niter)
+
+
+def solve_dense(cell: PVCell,
+                bound: Boundary,
+                pot_ini: Potentials,
+                opts: SolverOptions = SolverOptions()) -> Potentials:
+
+    pot, _ = solve_dense_aux(cell, bound, pot_ini, opts)
+
     return pot
 
 
@@ -339,54 +619,269 @@ def step(cell: PVCell,
          pot: Potentials,
          pl: Array,
          dxl: Array,
-         beta: f64 = 0.9) -> Tuple[Potentials, dict]:
+         beta: f64 = 0.9,
+         opts: SolverOptions = SolverOptions()
+         ) -> Tuple[Potentials, dict]:
 
-    F = residual.comp_F(cell, bound, pot)
-    spJ = residual.comp_F_deriv(cell, bound, pot)
-    p = logdamp(linalg.linsol(spJ, -F, tol=1e-6))
+    F, spJ = residual.comp_F_and_J(cell, bound, pot)
+    fact = linalg.factor(spJ, opts.linsol)
+    p = logdamp(linalg.factsol(spJ, fact, -F, 1e-6, opts.linsol))
     dx = acceleration(p, pl, dxl, beta)
     pot_new = modify(pot, dx)
 
     error = jnp.max(jnp.abs(p))
     resid = jnp.linalg.norm(F)
-    stats = {"error": error, "resid": resid, "p": p, "dx": dx}
+    stats = {
+        "error": error,
+        "resid": resid,
+        "p": p,
+        "dx": dx,
+        "jac": spJ,
+        "fact": fact
+    }
 
     return pot_new, stats
 
 
-@custom_jvp
-def solve(cell: PVCell, bound: Boundary, pot_ini: Potentials) -> Potentials:
+@jit
+def broyden(vec: Array, S: Array, A: Array, nb: i64) -> Array:
+
+    # Applies the product (I + a_nb-1 s_nb-1^T) ... (I + a_0 s_0^T) of the
+    # first nb stored rank-one factors to vec
+
+    def body_fun(j, vec):
+        return jnp.where(j < nb, vec + A[j] * jnp.dot(S[j], vec), vec)
+
+    return lax.fori_loop(0, S.shape[0], body_fun, vec)
+
+
+@jit
+def step_reuse(cell: PVCell,
+               bound: Boundary,
+               pot: Potentials,
+               stats: dict,
+               beta: f64 = 0.9,
+               opts: SolverOptions = SolverOptions()
+               ) -> Tuple[Potentials, dict]:
+
+    F = residual.comp_F(cell, bound, pot)
+
+    # The kept Jacobian is only rebuilt once it is too old or the iteration
+    # stops contracting fast enough
+    rate = stats["error"] / stats["errorl"]
+    renew = jnp.logical_or(stats["age"] >= opts.max_age, rate > opts.refresh)
+
+    def refactor(_):
+        spJ = residual.comp_F_deriv(cell, bound, pot)
+        return spJ, linalg.factor(spJ, opts.linsol)
+
+    def keep(_):
+        return stats["jac"], stats["fact"]
+
+    spJ, fact = lax.cond(renew, refactor, keep, None)
+    q = linalg.factsol(spJ, fact, F, 1e-6, opts.linsol)
+    S, A = stats["S"], stats["A"]
+    nb = jnp.where(renew, 0, stats["nb"])
+
+    if opts.newton == "broyden":
+        # Good Broyden update of the inverse Jacobian in product form, with
+        # H_k+1 = (I + a s^T) H_k, a = (s - H_k y) / (s^T H_k y), using the
+        # step s and residual change y of the previous iteration
+        q = broyden(q, S, A, nb)
+        s = stats["dx"]
+        u = q - stats["q"]
+        su = jnp.dot(s, u)
+        add = jnp.logical_and(
+            jnp.logical_and(jnp.logical_not(renew), stats["q_ok"]),
+            jnp.logical_and(nb < S.shape[0], su != 0))
+        a = jnp.where(add, (s - u) / jnp.where(add, su, 1), 0)
+        slot = jnp.minimum(nb, S.shape[0] - 1)
+        S = S.at[slot].set(jnp.where(add, s, S[slot]))
+        A = A.at[slot].set(jnp.where(add, a, A[slot]))
+        q = q + a * jnp.dot(s, q)
+        nb = nb + add
+
+    p = logdamp(-q)
+    dx = acceleration(p, stats["p"], stats["dx"], beta)
+    pot_new = modify(pot, dx)
+
+    error = jnp.max(jnp.abs(p))
+    resid = jnp.linalg.norm(F)
+    stats = {
+        "error": error,
+        "resid": resid,
+        "p": p,
+        "dx": dx,
+        "jac": spJ,
+        "fact": fact,
+        "age": jnp.where(renew, 0, stats["age"] + 1),
+        "errorl": jnp.where(renew, jnp.inf, stats["error"]),
+        "S": S,
+        "A": A,
+        "nb": nb,
+        "q": q,
+        "q_ok": jnp.ones_like(stats["q_ok"])
+    }
+
+    return pot_new, stats
+
+
+def reuse_ini(cell: PVCell,
+              bound: Boundary,
+              pot_ini: Potentials,
+              opts: SolverOptions = SolverOptions(),
+              aux_ini: dict = None) -> dict:
+
+    # Initial state of step_reuse. Without a Jacobian to start from, the age
+    # is set such that the first iteration builds one.
+
+    size = 3 * pot_ini.phi.size
+
+    if aux_ini is None:
+        jac = tree_util.tree_map(
+            lambda s: jnp.zeros(s.shape, s.dtype),
+            eval_shape(residual.comp_F_deriv, cell, bound, pot_ini))
+        fact = tree_util.tree_map(
+            lambda s: jnp.zeros(s.shape, s.dtype),
+            eval_shape(lambda jac: linalg.factor(jac, opts.linsol), jac))
+        age = opts.max_age
+    else:
+        jac, fact = aux_ini["jac"], aux_ini["fact"]
+        age = 0
+
+    return {
+        "error": f64(1),
+        "resid": f64(0),
+        "p": jnp.zeros(size),
+        "dx": jnp.zeros(size),
+        "jac": jac,
+        "fact": fact,
+        "age": i64(age),
+        "errorl": f64(jnp.inf),
+        "S": jnp.zeros((opts.max_age, size)),
+        "A": jnp.zeros((opts.max_age, size)),
+        "nb": i64(0),
+        "q": jnp.zeros(size),
+        "q_ok": jnp.array(False)
+    }
+
+
+def updater(cell: PVCell,
+            bound: Boundary,
+            pot_ini: Potentials,
+            opts: SolverOptions = SolverOptions(),
+            aux_ini: dict = None) -> Tuple[Callable, dict]:
+
+    # Sparse Newton update for the variant selected in opts, together with
+    # the statistics to start iterating from
+
+    if opts.newton == "full":
+
+        def update(pot, stats):
+            return step(cell, bound, pot, stats["p"], stats["dx"], opts=opts)
+
+        size = 3 * pot_ini.phi.size
+        stats_ini = blank(update, pot_ini, {
+            "p": jnp.zeros(size),
+            "dx": jnp.zeros(size)
+        })
+
+        return update, stats_ini
+
+    def update(pot, stats):
+        return step_reuse(cell, bound, pot, stats, opts=opts)
+
+    return update, reuse_ini(cell, bound, pot_ini, opts, aux_ini)
 
+
+@jit
+def newton(cell: PVCell,
+           bound: Boundary,
+           pot_ini: Potentials,
+           opts: SolverOptions = SolverOptions(),
+           aux_ini: dict = None) -> Tuple[Potentials, dict]:
+    """Solve the out-of-equilibrium system with the Newton loop compiled on
+    device
+
+    Args:
+        cell (PVCell): An initialized cell
+        bound (Boundary): Boundary conditions
+        pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Solver configuration. Defaults to
+            SolverOptions().
+        aux_ini (dict, optional): Jacobian "jac" and factorization "fact" to
+            start the chord and Broyden variants from. Defaults to None.
+
+    Returns:
+        Tuple[Potentials, dict]: Solution and iteration statistics, see
+            newton_eq
+    """
+    sparse, sparse_ini = updater(cell, bound, pot_ini, opts, aux_ini)
+
+    def dense(pot, stats):
+        return step_dense(cell, bound, pot, stats["p"], stats["dx"],
+                          opts=opts)
+
+    dense_ini = blank(dense, pot_ini, {
+        "p": sparse_ini["p"],
+        "dx": sparse_ini["dx"]
+    })
+
+    def refactor(jac):
+        return linalg.factor(jac, opts.linsol)
+
+    return fallback(sparse, dense, pot_ini, sparse_ini, dense_ini, refactor)
+
+
+def solve_aux(cell: PVCell,
+              bound: Boundary,
+              pot_ini: Potentials,
+              opts: SolverOptions = SolverOptions(),
+              aux_ini: dict = None) -> Tuple[Potentials, dict]:
+    """Solve the out-of-equilibrium system and keep the last Newton iteration
+
+    Args:
+        cell (PVCell): An initialized cell
+        bound (Boundary): Boundary conditions
+        pot_ini (Potentials): Initial guess of solution
+        opts (SolverOptions, optional): Solver configuration. Defaults to
+            SolverOptions().
+        aux_ini (dict, optional): Jacobian "jac" and factorization "fact" to
+            start the chord and Broyden variants from, usually those of a
+            previous solve. Ignored by the full Newton method. Defaults to
+            None.
+
+    Returns:
+        Tuple[Potentials, dict]: Solution and statistics of the last
+            iteration, including its Jacobian "jac" and factorization "fact"
+    """
+    if opts.compiled:
+        return newton(cell, bound, pot_ini, opts, aux_ini)
+
+    update, stats = updater(cell, bound, pot_ini, opts, aux_ini)
     pot = pot_ini
     error = 1
     niter = 0
-    pl = jnp.zeros(3 * pot.phi.size)
-    dxl = jnp.zeros(3 * pot.phi.size)
 
-    while niter < 100 and error > 1e-6:
+    while niter < n_newton and error > tol_newton:
 
-        pot, stats = step(cell, bound, pot, pl, dxl)
+        pot, stats = update(pot, stats)
         error = stats["error"]
         resid = stats["resid"]
-        pl = stats["p"]
-        dxl = stats["dx"]
         niter += 1
         logger.info("    iteration {:3d}    |p| = {:.2e}    |F| = {:.2e}".format(  # noqa
             niter, error, resid))
 
         if jnp.isnan(error) or error == 0:
             logger.error("    Sparse solver failed! Switching to dense.")
-            return solve_dense(cell, bound, pot_ini)
-
-    return pot
+            return solve_dense_aux(cell, bound, pot_ini, opts)
 
+    return pot, dict(stats, niter=niter)
 
-@solve.defjvp
-def solve_jvp(primals, tangents):
 
-    cell, bound, pot_ini = primals
-    dcell, dbound, _ = tangents
-    sol = solve(cell, bound, pot_ini)
+def tangent(cell: PVCell, bound: Boundary, sol: Potentials, fact: tuple,
+            dcell: PVCell, dbound: Boundary,
+            opts: SolverOptions) -> Potentials:
 
     zerodpot = Potentials(jnp.zeros_like(sol.phi), jnp.zeros_like(sol.phi_n),
                           jnp.zeros_like(sol.phi_p))
@@ -394,11 +889,93 @@ def solve_jvp(primals, tangents):
     _, rhs = jvp(residual.comp_F, (cell, bound, sol),
                  (dcell, dbound, zerodpot))
 
+    # The factorization of the last Newton iteration preconditions the solve
+    # with the Jacobian at the solution, so no new factorization is needed.
+    # Chord and Broyden iterations may have kept it for several iterations,
+    # so it is refreshed at the solution for them.
     spF_pot = residual.comp_F_deriv(cell, bound, sol)
-    F_pot = linalg.sparse2dense(spF_pot)
-    dF = jnp.linalg.solve(F_pot, -rhs)
+    if opts.newton != "full":
+        fact = linalg.factor(spF_pot, opts.linsol)
+    dF = linalg.refsol(spF_pot, fact, -rhs, 1e-12, opts.linsol)
+
+    return Potentials(dF[2::3], dF[0::3], dF[1::3])
+
+
+@custom_jvp
+def solve(cell: PVCell,
+          bound: Boundary,
+          pot_ini: Potentials,
+          opts: SolverOptions = SolverOptions()) -> Potentials:
+
+    pot, _ = solve_aux(cell, bound, pot_ini, opts)
+
+    return pot
+
+
+@solve.defjvp
+def solve_jvp(primals, tangents):
+
+    cell, bound, pot_ini, opts = primals
+    dcell, dbound, _, _ = tangents
+    sol, aux = solve_aux(cell, bound, pot_ini, opts)
 
     primal_out = sol
-    tangent_out = Potentials(dF[2::3], dF[0::3], dF[1::3])
+    tangent_out = tangent(cell, bound, sol, aux["fact"], dcell, dbound, opts)
+
+    return primal_out, tangent_out
+
+
+@custom_jvp
+def solve_reuse(cell: PVCell,
+                bound: Boundary,
+                pot_ini: Potentials,
+                aux_ini: dict = None,
+                opts: SolverOptions = SolverOptions()
+                ) -> Tuple[Potentials, dict]:
+    """Solve the out-of-equilibrium system, starting from and returning the
+    Jacobian and factorization kept by the chord and Broyden variants
+
+    Args:
+        cell (PVCell): An initialized cell
+        bound (Boundary): Boundary conditions
+        pot_ini (Potentials): Initial guess of solution
+        aux_ini (dict, optional): Jacobian "jac" and factorization "fact"
+            returned by a previous call. Defaults to None.
+        opts (SolverOptions, optional): Solver configuration. Defaults to
+            SolverOptions().
+
+    Returns:
+        Tuple[Potentials, dict]: Solution, and the Jacobian "jac" and
+            factorization "fact" to pass to the next call together with the
+            final Newton "error" and the number of iterations "niter". These
+            are treated as constants when differentiating.
+    """
+    pot, stats = solve_aux(cell, bound, pot_ini, opts, aux_ini)
+    aux = {
+        "jac": stats["jac"],
+        "fact": stats["fact"],
+        "error": stats["error"],
+        "niter": f64(stats["niter"])
+    }
+
+    return pot, aux
+
+
+@solve_reuse.defjvp
+def solve_reuse_jvp(primals, tangents):
+
+    cell, bound, pot_ini, aux_ini, opts = primals
+    dcell, dbound, _, _, _ = tangents
+    sol, stats = solve_aux(cell, bound, pot_ini, opts, aux_ini)
+    aux = {
+        "jac": stats["jac"],
+        "fact": stats["fact"],
+        "error": stats["error"],
+        "niter": f64(stats["niter"])
+    }
+
+    primal_out = sol, aux
+    tangent_out = (tangent(cell, bound, sol, aux["fact"], dcell, dbound,
+                           opts), tree_util.tree_map(jnp.zeros_like, aux))
 
     return primal_out, tangent_out
@@ -60,7 +60,7 @@ def ascent(df, x0=0., lr=1., tol=1e-6, niter=100):
     return x
 
 
-def findmax(x, coef):
+def findmax(x, coef, n=None):
 
     a, b, _ = coef
     xl = x[:-1]
@@ -72,6 +72,13 @@ def findmax(x, coef):
     yu = quadratic(xu, coef)
     ym = quadratic(xm, coef)
 
+    if n is not None:
+        # only the first n - 1 intervals hold data
+        valid = jnp.arange(xl.size) < n - 1
+        yl = jnp.where(valid, yl, -jnp.inf)
+        yu = jnp.where(valid, yu, -jnp.inf)
+        ym = jnp.where(valid, ym, -jnp.inf)
+
     xall = jnp.concatenate([xl, xu, xm])
     yall = jnp.concatenate([yl, yu, ym])
 
@@ -93,10 +100,13 @@ def calcPmax_gd(v, j):
     return pmax
 
 
-def calcPmax(v, j):
+def calcPmax(v, j, n=None):
+    # With n given, only the first n points are used. The spline is
+    # determined from left to right, so points after them (with distinct
+    # voltages and finite currents) do not change the fit.
     p = v * j
     coef = qspline(v, p)
-    pmax, vmax = findmax(v, coef)
+    pmax, vmax = findmax(v, coef, n)
     return pmax, vmax
 
 
@@ -91,8 +91,7 @@ def x2des(x, perov=Perov):
 
 def f(x):
     des = x2des(x)
-    results = dpv.simulate(des, verbose=False)
-    eff = results["eff"] * 100
+    eff = dpv.efficiency(des) * 100
     return -eff
 
 
@@ -1,12 +1,58 @@
 import unittest
+import dataclasses
+import tempfile
+import logging
+import os
 import deltapv as dpv
-from jax import numpy as jnp
+from jax import numpy as jnp, value_and_grad, log_compiles, jacfwd
 import numpy as np
 from scipy.optimize import minimize
 from optimize import psc
 from optimize import multi
 
 
+def pn_design(n_points=500, graded=False):
+    L = 3e-4
+    J = 5e-6
+    material = dpv.create_material(Chi=3.9,
+                                   Eg=1.5,
+                                   eps=9.4,
+                                   Nc=8e17,
+                                   Nv=1.8e19,
+                                   mn=100,
+                                   mp=100,
+                                   Et=0,
+                                   tn=1e-8,
+                                   tp=1e-8,
+                                   A=1e4)
+    design = dpv.make_design(n_points=n_points,
+                             Ls=[J, L - J],
+                             mats=[material, material],
+                             Ns=[1e17, -1e15],
+                             Snl=1e7,
+                             Snr=0,
+                             Spl=0,
+                             Spr=1e7,
+                             graded=graded)
+    return design
+
+
+def pn_jacobian(n_points=100, pad=None):
+    # Residual and Jacobian of pn_design at 0.5 V and the initial guess,
+    # returned after the cell, boundary and guess they are evaluated at. The
+    # cell is padded to pad nodes if given.
+    cell = dpv.simulator.init_cell(pn_design(n_points=n_points),
+                                   dpv.incident_light())
+    if pad is not None:
+        cell = dpv.mesh.pad(cell, pad)
+    bound = dpv.bcond.boundary(cell, 0.5 / dpv.scales.energy)
+    bound_eq = dpv.bcond.boundary_eq(cell)
+    pot = dpv.solver.ooe_guess(cell, dpv.solver.eq_guess(cell, bound_eq))
+    F = dpv.residual.comp_F(cell, bound, pot)
+    spJ = dpv.residual.comp_F_deriv(cell, bound, pot)
+    return cell, bound, pot, F, spJ
+
+
 class TestDeltaPV(unittest.TestCase):
     def test_iv(self):
         L = 3e-4
@@ -53,6 +99,425 @@ class TestDeltaPV(unittest.TestCase):
         self.assertTrue(jnp.allclose(v, v_correct), "Voltages do not match!")
         self.assertTrue(jnp.allclose(j, j_correct), "Currents do not match!")
 
+    def test_compiled(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        results_jit = dpv.simulate(design,
+                                   verbose=False,
+                                   opts=dpv.SolverOptions(compiled=True))
+        v, j = results["iv"]
+        v_jit, j_jit = results_jit["iv"]
+
+        self.assertTrue(jnp.allclose(v, v_jit), "Voltages do not match!")
+        self.assertTrue(jnp.allclose(j, j_jit), "Currents do not match!")
+
+        swept = dpv.simulator.run_sweep(results_jit["cell"],
+                                        results_jit["eq"],
+                                        opts=dpv.SolverOptions(compiled=True))
+        self.assertTrue(swept["converged"][0],
+                        "Short circuit step did not converge!")
+
+    def test_reuse(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        for newton in ["chord", "broyden"]:
+            opts = dpv.SolverOptions(newton=newton)
+            results_reuse = dpv.simulate(design, verbose=False, opts=opts)
+            v, j = results["iv"]
+            v_reuse, j_reuse = results_reuse["iv"]
+
+            self.assertTrue(jnp.allclose(v, v_reuse),
+                            f"Voltages do not match for {newton}!")
+            self.assertTrue(jnp.allclose(j, j_reuse),
+                            f"Currents do not match for {newton}!")
+
+    def test_adaptive(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        results_adapt = dpv.simulate(design, adaptive=True, verbose=False)
+        v, j = results_adapt["iv"]
+
+        self.assertTrue(jnp.all(jnp.diff(v) > 0),
+                        "Voltages are not increasing!")
+        self.assertTrue(j[-1] < 0, "Sweep stopped before Voc!")
+        self.assertTrue(
+            jnp.allclose(results["eff"], results_adapt["eff"], rtol=1e-3),
+            "Efficiencies do not match!")
+
+    def test_parallel(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        results_par = dpv.simulate(design, parallel=True, verbose=False)
+        v, j = results["iv"]
+        v_par, j_par = results_par["iv"]
+
+        self.assertTrue(jnp.allclose(v, v_par), "Voltages do not match!")
+        self.assertTrue(jnp.allclose(j, j_par), "Currents do not match!")
+
+    def test_anchors(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        v, j = results["iv"]
+
+        # Anchors below the open circuit voltage only, on a padded cell
+        half = v.size // 2
+        results_anc = dpv.simulate(design,
+                                   anchors=(v[:half], results["pots"][:half]),
+                                   verbose=False,
+                                   opts=dpv.SolverOptions(bucket=True))
+        v_anc, j_anc = results_anc["iv"]
+
+        self.assertTrue(jnp.allclose(v, v_anc), "Voltages do not match!")
+        self.assertTrue(jnp.allclose(j, j_anc), "Currents do not match!")
+
+    def test_efficiency_grad(self):
+        design = pn_design(n_points=200)
+
+        def f(design):
+            return dpv.simulate(design, verbose=False)["eff"]
+
+        eff, deff = value_and_grad(f)(design)
+        eff_adj, deff_adj = dpv.efficiency_and_grad(design)
+
+        self.assertTrue(jnp.allclose(eff, eff_adj),
+                        "Efficiencies do not match!")
+        for name in ["Eg", "tn", "mn", "Ndop"]:
+            g, g_adj = getattr(deff, name), getattr(deff_adj, name)
+            self.assertTrue(
+                jnp.max(jnp.abs(g - g_adj)) < 1e-5 * jnp.max(jnp.abs(g)),
+                f"Gradients for {name} do not match!")
+
+    def test_checkpoint(self):
+        design = pn_design(n_points=200)
+
+        def f(design, checkpoint):
+            results = dpv.simulate(design,
+                                   checkpoint=checkpoint,
+                                   verbose=False)
+            _, j = results["iv"]
+            return jnp.sum(j**2) + jnp.sum(results["pots"][5].phi_n)
+
+        y, dy = value_and_grad(f)(design, False)
+        y_ckpt, dy_ckpt = value_and_grad(f)(design, True)
+
+        self.assertTrue(jnp.allclose(y, y_ckpt), "Objectives do not match!")
+        for name in ["Eg", "tn", "Ndop"]:
+            g, g_ckpt = getattr(dy, name), getattr(dy_ckpt, name)
+            self.assertTrue(
+                jnp.max(jnp.abs(g - g_ckpt)) < 1e-5 * jnp.max(jnp.abs(g)),
+                f"Gradients for {name} do not match!")
+
+    def test_operating_point(self):
+        design = pn_design()
+        results = dpv.simulate(design, verbose=False)
+        v, j = results["iv"]
+        jsc, _ = dpv.short_circuit(design, verbose=False)
+        voc, _ = dpv.open_circuit(design, verbose=False)
+        mpp = dpv.max_power(design, verbose=False)
+
+        self.assertTrue(jnp.allclose(jsc, j[0]),
+                        "Short-circuit currents do not match!")
+        self.assertTrue(v[-2] < voc < v[-1], "Voc is not bracketed!")
+        self.assertTrue(
+            jnp.allclose(mpp["eff"], results["eff"], rtol=1e-3),
+            "Efficiencies do not match!")
+
+    def test_batch(self):
+        base = pn_design(n_points=200)
+        designs = [
+            dpv.objects.PVDesign(**dict(base.__dict__, Eg=base.Eg + dEg))
+            for dEg in [0, 0.05 / dpv.scales.energy]
+        ]
+        results = dpv.simulate_batch(designs, verbose=False)
+        for i, design in enumerate(designs):
+            result = dpv.simulate(design, verbose=False)
+            v, j = result["iv"]
+            n = int(results["n"][i])
+
+            self.assertEqual(n, v.size, "Step counts do not match!")
+            self.assertTrue(jnp.allclose(results["iv"][1][i, :n], j),
+                            "Currents do not match!")
+            self.assertTrue(jnp.allclose(results["eff"][i], result["eff"]),
+                            "Efficiencies do not match!")
+
+    def test_G_cache(self):
+        design = pn_design(n_points=100)
+        ls = dpv.incident_light()
+        dpv.optical.clear_cache()
+        G = dpv.optical.compute_G(design, ls)
+        electrical = dpv.objects.PVDesign(
+            **dict(design.__dict__, mn=2 * design.mn))
+        optical = dpv.objects.PVDesign(
+            **dict(design.__dict__, Eg=design.Eg + 0.1))
+
+        self.assertIs(dpv.optical.compute_G(electrical, ls), G,
+                      "Generation density was not reused!")
+        self.assertFalse(
+            jnp.allclose(dpv.optical.compute_G(optical, ls), G, atol=0),
+            "Generation density was reused for a different band gap!")
+        self.assertTrue(
+            jnp.allclose(G, dpv.optical.generation(design, ls), atol=0),
+            "Cached generation density does not match!")
+        P_in = np.asarray(ls.P_in)
+        reinterpreted = dpv.objects.LightSource(
+            **dict(ls.__dict__, P_in=P_in.view(f"i{P_in.itemsize}")))
+        self.assertNotEqual(dpv.optical.cache_key(design, ls, True),
+                            dpv.optical.cache_key(design, reinterpreted,
+                                                  True),
+                            "Keys ignore the dtype!")
+
+    def test_generation_basis(self):
+        design = pn_design(n_points=100)
+        ls = dpv.incident_light()
+        basis = dpv.optical.generation_basis(design, ls.Lambda)
+        spectra = jnp.stack([ls.P_in, 2 * ls.P_in, ls.P_in[::-1]])
+        Gs = dpv.optical.basis_G(basis, spectra)
+
+        for P_in, G in zip(spectra, Gs):
+            G_correct = dpv.optical.generation(
+                design, dpv.objects.LightSource(Lambda=ls.Lambda, P_in=P_in))
+            self.assertTrue(jnp.allclose(G, G_correct, atol=0),
+                            "Generation densities do not match!")
+
+    def test_energy_yield(self):
+        design = pn_design()
+        ls = dpv.incident_light()
+        spectra = jnp.outer(jnp.array([1, 0, 0.5]), ls.P_in)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "yield.csv")
+            results = dpv.energy_yield(design,
+                                       ls.Lambda,
+                                       spectra,
+                                       path=path,
+                                       verbose=False)
+            streamed = np.genfromtxt(path, delimiter=",", names=True)
+        mpp = dpv.max_power(design, ls, verbose=False)
+
+        self.assertTrue(jnp.allclose(results["eff"][0], mpp["eff"]),
+                        "Efficiencies do not match!")
+        self.assertTrue(results["mpp"][1] == 0, "Dark condition has power!")
+        self.assertTrue(
+            np.allclose(results["energy"], np.sum(streamed["mpp"])),
+            "Streamed results do not match!")
+        self.assertEqual(sorted(streamed["condition"]), [0, 1, 2],
+                         "Conditions are missing from the file!")
+
+    def test_grid_sequencing(self):
+        design = pn_design(n_points=1000)
+        opts = dpv.SolverOptions(levels=2)
+        results = dpv.simulate(design, n_steps=3, verbose=False)
+        results_seq = dpv.simulate(design,
+                                   n_steps=3,
+                                   verbose=False,
+                                   opts=opts)
+
+        self.assertTrue(
+            jnp.allclose(results["eq"].phi, results_seq["eq"].phi),
+            "Equilibrium solutions do not match!")
+        self.assertTrue(
+            jnp.allclose(results["iv"][1], results_seq["iv"][1]),
+            "Currents do not match!")
+
+    def test_graded_grid(self):
+        grid = pn_design(n_points=150, graded=True).grid
+        dgrid = jnp.diff(grid)
+        eff = dpv.simulate(pn_design(n_points=1000), verbose=False)["eff"]
+        eff_uniform = dpv.simulate(pn_design(n_points=150),
+                                   verbose=False)["eff"]
+        eff_graded = dpv.simulate(pn_design(n_points=150, graded=True),
+                                  verbose=False)["eff"]
+
+        self.assertEqual(grid.size, 150, "Wrong number of points!")
+        self.assertTrue(jnp.all(dgrid > 0), "Grid is not increasing!")
+        self.assertTrue(jnp.any(jnp.isclose(grid, 5e-6 / dpv.scales.length)),
+                        "No point on the interface!")
+        self.assertTrue(
+            jnp.abs(eff_graded - eff) < jnp.abs(eff_uniform - eff),
+            "Graded grid is less accurate than uniform grid!")
+
+    def test_refine(self):
+        design = pn_design(n_points=121)
+        refined, pot_eq = dpv.simulator.refine_design(design, passes=1)
+        refined_bucket, _ = dpv.simulator.refine_design(
+            design, passes=1, opts=dpv.SolverOptions(bucket=True))
+        bisected, _ = dpv.mesh.refine(refined, [pot_eq], tol=0.)
+        eff = dpv.simulate(pn_design(n_points=1000), verbose=False)["eff"]
+        eff_uniform = dpv.simulate(design, verbose=False)["eff"]
+        eff_refined = dpv.simulate(design, refine=1, verbose=False)["eff"]
+
+        self.assertGreater(refined.grid.size, 121, "Grid was not refined!")
+        self.assertEqual(refined.grid.size,
+                         dpv.mesh.bucket(refined.grid.size),
+                         "Refined grid is not a bucket size!")
+        self.assertEqual(refined_bucket.grid.size, refined.grid.size,
+                         "Padded cells refine differently!")
+        self.assertEqual(bisected.grid.size,
+                         dpv.mesh.bucket(bisected.grid.size),
+                         "Fully refined grid is not a bucket size!")
+        self.assertLess(bisected.grid.size, 2 * refined.grid.size,
+                        "Intervals were split more than once!")
+        self.assertTrue(jnp.all(jnp.diff(refined.grid) > 0),
+                        "Grid is not increasing!")
+        self.assertTrue(
+            jnp.abs(eff_refined - eff) < jnp.abs(eff_uniform - eff),
+            "Refined grid is less accurate than initial grid!")
+
+    def test_bucket(self):
+        design = pn_design(n_points=121)
+        opts = dpv.SolverOptions(bucket=True)
+        results = dpv.simulate(design, verbose=False)
+        results_bucket = dpv.simulate(design, verbose=False, opts=opts)
+
+        self.assertEqual(results_bucket["cell"].Eg.size,
+                         dpv.mesh.bucket(121), "Cell was not padded!")
+        self.assertEqual(results_bucket["pots"][0].phi.size, 121,
+                         "Solutions were not unpadded!")
+        self.assertTrue(
+            jnp.allclose(results["iv"][1], results_bucket["iv"][1]),
+            "Currents do not match!")
+        self.assertTrue(
+            jnp.allclose(results["eq"].phi, results_bucket["eq"].phi),
+            "Equilibrium solutions do not match!")
+
+    def test_warmup(self):
+        opts = dpv.SolverOptions(bucket=True)
+        results = dpv.warmup(n_points=np.int64(57), opts=opts,
+                             verbose=False)
+        with log_compiles(), self.assertLogs("jax", "WARNING") as logs:
+            logging.getLogger("jax").warning("Solving after warm-up")
+            dpv.equilibrium(pn_design(n_points=57), None, opts)
+        kernels = [line for line in logs.output if "step_eq" in line]
+
+        self.assertEqual(len(results["time"]), 1, "Wrong number of sizes!")
+        self.assertEqual(kernels, [], "Kernels were compiled again!")
+
+    def test_masked_pmax(self):
+        v = jnp.linspace(0, 1, 20)
+        j = 1 - jnp.exp(10 * (v - 1))
+        pmax, vmax = dpv.spline.calcPmax(v[:12], j[:12])
+        padded = jnp.where(jnp.arange(20) < 12, j, 0)
+        pmax_mask, vmax_mask = dpv.spline.calcPmax(v, padded, 12)
+
+        self.assertTrue(jnp.allclose(pmax, pmax_mask), "Powers do not match!")
+        self.assertTrue(jnp.allclose(vmax, vmax_mask),
+                        "Voltages do not match!")
+
+    def test_banded(self):
+        cell, bound, pot, F, spJ = pn_jacobian()
+        J = dpv.linalg.sparse2dense(spJ)
+        spJT = dpv.linalg.transpose(spJ)
+
+        self.assertEqual(dpv.linalg.bandwidth(spJ), 5, "Wrong bandwidth!")
+        self.assertTrue(jnp.allclose(dpv.linalg.sparse2dense(spJT), J.T),
+                        "Transposes do not match!")
+        self.assertTrue(jnp.allclose(dpv.linalg.spmatvec(spJ, F), J @ F),
+                        "Products do not match!")
+        self.assertTrue(jnp.allclose(dpv.linalg.spmatvec(spJT, F), J.T @ F),
+                        "Transposed products do not match!")
+
+        # The directly assembled bands agree with autodiff of the residual
+        J_ad = jacfwd(lambda x: dpv.residual.comp_F(
+            cell, bound, dpv.solver.vec2pot(x)))(dpv.solver.pot2vec(pot))
+        self.assertTrue(jnp.allclose(J, J_ad), "Jacobians do not match!")
+
+        # Within the bandwidth of the Jacobian, the incomplete LU is exact
+        fact = dpv.linalg.spilu(spJ)
+        x = dpv.linalg.bsub(fact, dpv.linalg.fsub(fact, F))
+        self.assertTrue(jnp.allclose(J @ x, F), "ILU solution does not match!")
+
+    def test_fused(self):
+        for pad in [None, dpv.mesh.bucket(121)]:
+            cell, bound, pot, F, spJ = pn_jacobian(n_points=121, pad=pad)
+            F_fused, spJ_fused = dpv.residual.comp_F_and_J(cell, bound, pot)
+
+            self.assertTrue(jnp.allclose(F_fused, F),
+                            "Residuals do not match!")
+            self.assertTrue(
+                jnp.allclose(dpv.linalg.sparse2dense(spJ_fused),
+                             dpv.linalg.sparse2dense(spJ)),
+                "Jacobians do not match!")
+
+    def test_blockinv(self):
+        # Rows scaled apart by up to 240 orders of magnitude, and all rows
+        # small enough for the unscaled determinant to underflow
+        blocks = np.random.default_rng(0).normal(size=(64, 3, 3))
+        rows = 10.**np.array([[-120, 0, 120], [-120, -120, -120],
+                                [200, -40, 0], [0, 0, 0]])
+        blocks = blocks * np.repeat(rows, 16, axis=0)[..., None]
+        inv = dpv.linalg.blockinv(jnp.asarray(blocks))
+
+        self.assertTrue(jnp.allclose(inv @ blocks, jnp.eye(3), atol=1e-9),
+                        "Block inverses are not inverses!")
+        self.assertTrue(
+            jnp.allclose(inv, jnp.linalg.inv(blocks), rtol=1e-7, atol=0),
+            "Block inverses do not match!")
+
+        _, _, _, F, spJ = pn_jacobian()
+        fact = dpv.linalg.factor(spJ, "gmres")
+        x = dpv.linalg.factsol(spJ, fact, F, 1e-12, "gmres")
+        self.assertTrue(
+            jnp.allclose(x, jnp.linalg.solve(dpv.linalg.sparse2dense(spJ),
+                                             F)),
+            "Preconditioned GMRES solution does not match!")
+
+    def test_refsol(self):
+        _, _, _, F, spJ = pn_jacobian()
+        J = dpv.linalg.sparse2dense(spJ)
+        fact = dpv.linalg.factor(spJ, "block")
+        x = dpv.linalg.refsol(spJ, fact, F, 1e-12, "block")
+        xt = dpv.linalg.reftsol(spJ, fact, F, 1e-12, "block")
+
+        self.assertTrue(jnp.allclose(x, jnp.linalg.solve(J, F)),
+                        "Preconditioned solution does not match!")
+        self.assertTrue(jnp.allclose(xt, jnp.linalg.solve(J.T, F)),
+                        "Transposed preconditioned solution does not match!")
+
+        # A preconditioner too far from the matrix flags the solution
+        main = jnp.array(spJ.offsets)[:, None] == 0
+        stale = dataclasses.replace(spJ,
+                                    data=jnp.where(main, 1., .5) * spJ.data)
+        fact = dpv.linalg.factor(stale, "block")
+        x = dpv.linalg.refsol(spJ, fact, F, 1e-12, "block")
+
+        self.assertTrue(jnp.all(jnp.isnan(x)),
+                        "Unconverged solution is not flagged!")
+
+    def test_blocksol(self):
+        _, _, _, F, spJ = pn_jacobian()
+        J = dpv.linalg.sparse2dense(spJ)
+
+        fact = dpv.linalg.blockfactor(*dpv.linalg.sparse2block(spJ))
+        x = dpv.linalg.blocksolve(fact, F)
+        xt = dpv.linalg.blocktsolve(fact, F)
+
+        self.assertTrue(jnp.allclose(x, jnp.linalg.solve(J, F)),
+                        "Block solution does not match!")
+        self.assertTrue(jnp.allclose(xt, jnp.linalg.solve(J.T, F)),
+                        "Transposed block solution does not match!")
+
+    def test_cr(self):
+        design = pn_design(n_points=150)
+        _, _, _, F, spJ = pn_jacobian(n_points=150)
+        J = dpv.linalg.sparse2dense(spJ)
+
+        fact = dpv.linalg.factor(spJ, "cr")
+        x = dpv.linalg.crsolve(fact, F)
+        xt = dpv.linalg.crtsolve(fact, F)
+
+        self.assertTrue(jnp.allclose(x, jnp.linalg.solve(J, F)),
+                        "Cyclic reduction solution does not match!")
+        self.assertTrue(jnp.allclose(xt, jnp.linalg.solve(J.T, F)),
+                        "Transposed cyclic reduction solution does not "
+                        "match!")
+
+        results = dpv.simulate(design, verbose=False)
+        results_cr = dpv.simulate(design,
+                                  verbose=False,
+                                  opts=dpv.SolverOptions(linsol="cr"))
+
+        self.assertTrue(jnp.allclose(results["iv"][1], results_cr["iv"][1]),
+                        "Currents do not match!")
+
     def test_psc(self):
         bounds = [(1, 5), (1, 5), (1, 20), (17, 20), (17, 20), (0, 3), (0, 3),
                   (1, 5), (1, 5), (1, 20), (17, 20), (17, 20), (0, 3), (0, 3),